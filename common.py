@@ -1,21 +1,168 @@
-from datetime import time
+import time
 from pyspark.sql import SparkSession
-spark = SparkSession.builder.appName("Tradepanel").getOrCreate()
 import os
-from pyspark.sql.functions import *
-from pyspark.sql import Row
-from pyspark.sql.types import *
+from pyspark.sql.functions import col, current_timestamp, date_format, expr, lit, trim, when
+from pyspark.sql import Row, DataFrame
+from pyspark.sql.types import LongType
+from pyspark import StorageLevel
 from pyspark.sql import functions as F
 import zipfile
 import re
+import io
+import csv
+import json
+import uuid
+import random
+from itertools import islice
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from time import monotonic
+import threading
+from contextlib import contextmanager
 
 import psycopg2
+import psycopg2.pool
+from psycopg2.extras import execute_batch
 
 # Define the light refined path
 LIGHT_REFINED_PATH='tp-publish-data/'
 
+# Host of the reference PostgreSQL database used by the psycopg2 helpers
+REF_DB_HOST = "psql-pg-flex-tpconsole-dev-1.postgres.database.azure.com"
+
+# Driver-side psycopg2 connection pool settings, see configure_postgres_pool
+PG_POOL_MINCONN = 1
+PG_POOL_MAXCONN = 5
+# Seconds to wait for a free connection before giving up
+PG_POOL_TIMEOUT = 60
+# Idle seconds after which a pooled connection is pinged before being handed out
+PG_POOL_PING_AFTER = 30
+
 import argparse
 
+# Seconds a cached reference-data lookup stays valid, per PostgreSQL table
+LOOKUP_CACHE_TTL = {
+    'mm_col_asign_lkp': 3600,
+    'mm_cntrt_lkp': 3600,
+    'mm_cntrt_file_lkp': 3600,
+    'mm_col_dlmtr_lkp': 3600,
+    'mm_secur_grp_key_lkp': 3600,
+    'mm_cntrt_secur_grp_key_assoc_vw': 3600,
+}
+LOOKUP_CACHE_DEFAULT_TTL = 600
+LOOKUP_CACHE_MAXSIZE = 256
+
+#########################################################################
+
+class LookupCache:
+    """
+    Driver-side LRU cache for reference-data lookups with a TTL per source table.
+
+    Entries are keyed on (query, parameters) and tagged with the tables they were read
+    from, so invalidate(table) evicts every lookup that depends on that table.
+    Spark DataFrames are cached on insert and unpersisted on eviction.
+    """
+    def __init__(self, maxsize=LOOKUP_CACHE_MAXSIZE, ttl=None, default_ttl=LOOKUP_CACHE_DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = LOOKUP_CACHE_TTL if ttl is None else ttl
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_or_load(self, tables, query, loader, params=None):
+        """
+        Returns the cached result of query, calling loader() to read it on a miss.
+
+        Parameters:
+        tables (str or tuple): The table(s) the lookup reads; they drive TTL and invalidation.
+        query (str): The SQL query, used as part of the cache key.
+        loader (callable): Reads the result when it is not cached.
+        params (tuple): Optional query parameters, used as part of the cache key.
+        """
+        if isinstance(tables, str):
+            tables = (tables,)
+        key = (query, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = loader()
+        if isinstance(value, DataFrame):
+            value = value.cache()
+        ttl = min(self.ttl.get(table, self.default_ttl) for table in tables)
+
+        with self._lock:
+            self._evict(key)
+            self._entries[key] = (monotonic() + ttl, frozenset(tables), value)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+        return value
+
+    def invalidate(self, table=None):
+        # Drop every entry read from table, or the whole cache when no table is given
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if table is None or table in entry[1]]:
+                self._evict(key)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _evict(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and isinstance(entry[2], DataFrame):
+            entry[2].unpersist()
+
+# Shared cache used by the load_cntrt_* helpers and add_secure_group_key
+lookup_cache = LookupCache()
+
+#########################################################################
+
+# Backoff between two checks of a contended run lock: first wait, growth factor and cap, in seconds
+LOCK_POLL_INITIAL = 1
+LOCK_POLL_MULTIPLIER = 2
+LOCK_POLL_MAX_WAIT = 30
+
+# Backend holding the run locks: "delta" (tp_run_lock_plc Delta table) or "postgres"
+# (tp_run_lock_plc table in the reference database, see semaphore_acquisition)
+LOCK_BACKEND = "delta"
+# Key of the transaction-level advisory lock that serializes lock grants in PostgreSQL
+PG_LOCK_ADVISORY_KEY = 720_531_001
+# Seconds a queued or granted lock stays valid without being renewed. The heartbeat started by
+# semaphore_acquisition renews it every third of that, so a crashed run's locks lapse on their own
+LOCK_LEASE_SECONDS = 300
+# Hours of removed lock table files kept by VACUUM in maintain_lock_table
+LOCK_TABLE_VACUUM_RETAIN_HOURS = 168
+# Property of tp_run_lock_plc_audit holding the last lock table version maintain_lock_table audited
+LOCK_AUDIT_VERSION_PROPERTY = 'tp.audit.lastVersion'
+# Attempts of a Delta lock table write (grant, release, lease renewal) when it loses a write conflict
+LOCK_MERGE_RETRIES = 3
+# Consecutive failed renewals after which the lock heartbeat gives up and raises; the lease
+# lapses on the third missed beat
+LOCK_HEARTBEAT_MAX_FAILURES = 2
+
+# Shared SparkSession, created on first use by get_spark
+_spark = None
+_spark_lock = threading.Lock()
+
+def get_spark():
+    """
+    Returns the notebook's active SparkSession, or creates one on first use so that
+    importing this module neither starts a JVM nor shadows the notebook's spark.
+    """
+    global _spark
+    if _spark is None:
+        with _spark_lock:
+            if _spark is None:
+                _spark = SparkSession.getActiveSession() or SparkSession.builder.appName("Tradepanel").getOrCreate()
+    return _spark
+
 #########################################################################
 
 def read_run_params():
@@ -42,7 +189,7 @@ def get_dbutils(spark):
 def load_cntrt_col_assign(cntrt_id):
     query = f'''select * from {postgres_schema}.mm_col_asign_lkp where cntrt_id = {cntrt_id}'''
     # Read the data from PostgreSQL into a DataFrame
-    df_dpf_col_asign_vw=read_query_from_postgres(query)
+    df_dpf_col_asign_vw=lookup_cache.get_or_load('mm_col_asign_lkp', query, lambda: read_query_from_postgres(query))
     return df_dpf_col_asign_vw
 
 ###############################################################################
@@ -50,7 +197,7 @@ def load_cntrt_col_assign(cntrt_id):
 def load_cntrt_lkp(cntrt_id):
     query = f'''SELECT file_patrn FROM {postgres_schema}.mm_cntrt_lkp WHERE cntrt_id= {cntrt_id}'''
     # Read the data from PostgreSQL into a DataFrame
-    df_cntrt_lkp=read_query_from_postgres(query)
+    df_cntrt_lkp=lookup_cache.get_or_load('mm_cntrt_lkp', query, lambda: read_query_from_postgres(query))
     return df_cntrt_lkp
 
 ###############################################################################
@@ -58,7 +205,7 @@ def load_cntrt_lkp(cntrt_id):
 def load_cntrt_file_lkp(cntrt_id, dmnsn_name):
     query = f"""SELECT file_patrn FROM {postgres_schema}.mm_cntrt_file_lkp WHERE cntrt_id={cntrt_id} AND dmnsn_name='{dmnsn_name}' """
     # Read the data from PostgreSQL into a DataFrame
-    df_cntrt_file_lkp=read_query_from_postgres(query)
+    df_cntrt_file_lkp=lookup_cache.get_or_load('mm_cntrt_file_lkp', query, lambda: read_query_from_postgres(query))
     return df_cntrt_file_lkp
 
 ###############################################################################
@@ -66,38 +213,327 @@ def load_cntrt_file_lkp(cntrt_id, dmnsn_name):
 def load_cntrt_dlmtr_lkp(cntrt_id, dmnsn_name):
     query = f"""SELECT dt.dlmtr_val FROM {postgres_schema}.mm_cntrt_file_lkp ct join {postgres_schema}.mm_col_dlmtr_lkp dt on ct.dlmtr_id = dt.dlmtr_id WHERE cntrt_id={cntrt_id} AND dmnsn_name='{dmnsn_name}' """
     # Read the data from PostgreSQL into a DataFrame
-    df_cntrt_dlmtr_lkp=read_query_from_postgres(query)
+    df_cntrt_dlmtr_lkp=lookup_cache.get_or_load(('mm_cntrt_file_lkp', 'mm_col_dlmtr_lkp'), query, lambda: read_query_from_postgres(query))
     return df_cntrt_dlmtr_lkp
 
 ###############################################################################
 
-def acn_prod_trans_materialize(df,run_id):
+@dataclass(frozen=True)
+class CntrtMetadata:
+    """
+    In-memory bundle of the contract lookups returned by load_cntrt_metadata.
+
+    Attributes:
+    cntrt_id: The contract the lookups were loaded for.
+    file_patrn (str): file_patrn from mm_cntrt_lkp, None if the contract has no entry.
+    col_assign (list): Rows of mm_col_asign_lkp for the contract, one dict per row.
+    dmnsn_file_patrn (dict): dmnsn_name -> file_patrn from mm_cntrt_file_lkp.
+    dmnsn_dlmtr (dict): dmnsn_name -> dlmtr_val from mm_col_dlmtr_lkp.
+    """
+    cntrt_id: object
+    file_patrn: str = None
+    col_assign: list = field(default_factory=list)
+    dmnsn_file_patrn: dict = field(default_factory=dict)
+    dmnsn_dlmtr: dict = field(default_factory=dict)
+
+    def col_assign_for(self, dmnsn_name):
+        # Column assignments restricted to one dimension
+        return [row for row in self.col_assign if row.get('dmnsn_name') == dmnsn_name]
+
+###############################################################################
+
+def load_cntrt_metadata(cntrt_id, dmnsn_names=None):
+    """
+    Reads all the contract lookups (column assignments, file patterns and delimiters)
+    over a single PostgreSQL connection instead of one JDBC read per lookup.
+
+    Parameters:
+    cntrt_id: The contract ID to load.
+    dmnsn_names (list): Optional dimension names to restrict the per-dimension lookups to.
+
+    Returns:
+    CntrtMetadata: The contract lookups as plain Python objects.
+    """
+    dmnsn_key = tuple(dmnsn_names) if dmnsn_names else None
+    return lookup_cache.get_or_load(
+        ('mm_col_asign_lkp', 'mm_cntrt_lkp', 'mm_cntrt_file_lkp', 'mm_col_dlmtr_lkp'),
+        f'load_cntrt_metadata:{postgres_schema}',
+        lambda: _read_cntrt_metadata(cntrt_id, dmnsn_names),
+        params=(cntrt_id, dmnsn_key),
+    )
+
+def _read_cntrt_metadata(cntrt_id, dmnsn_names):
+    col_dmnsn_filter = file_dmnsn_filter = ''
+    params = (cntrt_id,)
+    if dmnsn_names:
+        col_dmnsn_filter = ' AND dmnsn_name = ANY(%s)'
+        file_dmnsn_filter = ' AND ct.dmnsn_name = ANY(%s)'
+        params = (cntrt_id, list(dmnsn_names))
+
+    with postgres_transaction() as cursor:
+        cursor.execute(f'''select * from {postgres_schema}.mm_col_asign_lkp where cntrt_id = %s{col_dmnsn_filter}''', params)
+        col_assign = _rows_as_dicts(cursor)
+
+        cursor.execute(f'''SELECT file_patrn FROM {postgres_schema}.mm_cntrt_lkp WHERE cntrt_id= %s''', (cntrt_id,))
+        cntrt_rows = cursor.fetchall()
+
+        # File pattern and delimiter per dimension share mm_cntrt_file_lkp, so read them together
+        cursor.execute(f"""SELECT ct.dmnsn_name, ct.file_patrn, dt.dlmtr_val FROM {postgres_schema}.mm_cntrt_file_lkp ct left join {postgres_schema}.mm_col_dlmtr_lkp dt on ct.dlmtr_id = dt.dlmtr_id WHERE ct.cntrt_id=%s{file_dmnsn_filter}""", params)
+        dmnsn_rows = cursor.fetchall()
+
+    return CntrtMetadata(
+        cntrt_id=cntrt_id,
+        file_patrn=cntrt_rows[0][0] if cntrt_rows else None,
+        col_assign=col_assign,
+        dmnsn_file_patrn={dmnsn_name: file_patrn for dmnsn_name, file_patrn, _ in dmnsn_rows},
+        dmnsn_dlmtr={dmnsn_name: dlmtr_val for dmnsn_name, _, dlmtr_val in dmnsn_rows if dlmtr_val is not None},
+    )
+
+###############################################################################
+
+# Target size and compression codec of the files written by acn_prod_trans_materialize in "partitioned" mode.
+# The size is measured in shuffle bytes, before parquet compression, so files come out smaller
+MATERIALIZE_TARGET_FILE_BYTES = 256 * 1024 * 1024
+MATERIALIZE_CODEC = "zstd"
+MATERIALIZE_MODES = ('single', 'partitioned')
+MATERIALIZE_ADVISORY_SIZE_CONF = "spark.sql.adaptive.advisoryPartitionSizeInBytes"
+
+def acn_prod_trans_materialize(df,run_id, mode='single', partition_by=None, target_file_bytes=MATERIALIZE_TARGET_FILE_BYTES, codec=MATERIALIZE_CODEC):
+    """
+    Writes the product chain of the run as parquet.
+
+    mode 'single' writes one file through one task. mode 'partitioned' keeps the write
+    parallel and leaves the file sizes to AQE: a REBALANCE on partition_by (e.g.
+    ["pg_categ_txt"]) splits large values and coalesces small ones into shuffle partitions
+    of about target_file_bytes, one file each. The files are compressed with codec and,
+    with partition_by, laid out in one directory per value. It then writes a
+    _manifest.json next to the data, listing the files, and returns the manifest.
+    """
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(f"Invalid mode {mode!r}, expected one of {MATERIALIZE_MODES}")
     path=f'/mnt/{LIGHT_REFINED_PATH}ACN_Prod_Load/{run_id}/ACN_Prod_Load_chain/tp_mm_ACN_Prod_Load_chain.parquet'
-    df.coalesce(1).write.format("parquet").options(header=True).mode('overwrite').save(path)\
+    if mode == 'single':
+        df.coalesce(1).write.format("parquet").options(header=True).mode('overwrite').save(path)
+        return None
+
+    partition_by = list(partition_by or [])
+    writer = df.hint("rebalance", *partition_by).write.format("parquet").option("compression", codec).mode('overwrite')
+    if partition_by:
+        writer = writer.partitionBy(*partition_by)
+
+    # AQE reads the advisory size while the write runs, so it is only set for the write
+    conf = get_spark().conf
+    previous_size = conf.get(MATERIALIZE_ADVISORY_SIZE_CONF, None)
+    conf.set(MATERIALIZE_ADVISORY_SIZE_CONF, str(target_file_bytes))
+    try:
+        writer.save(path)
+    finally:
+        if previous_size is None:
+            conf.unset(MATERIALIZE_ADVISORY_SIZE_CONF)
+        else:
+            conf.set(MATERIALIZE_ADVISORY_SIZE_CONF, previous_size)
+
+    # Files starting with an underscore are skipped by parquet readers of the path
+    files = sorted(get_spark().read.parquet(path).inputFiles())
+    manifest = {
+        'run_id': run_id,
+        'path': path,
+        'codec': codec,
+        'partition_by': partition_by,
+        'target_file_bytes': target_file_bytes,
+        'num_files': len(files),
+        'files': files,
+    }
+    dbutils.fs.put(f"{path}/_manifest.json", json.dumps(manifest, indent=2), True) # type: ignore
+    print(f"Materialized {len(files)} file(s) to {path}")
+    return manifest
 
 ############################################################################################
 
-def acn_prod_trans(srce_sys_id, TIME_PERD_TYPE_CODE ):
-    # Read PROD_DIM schema from Delta Table
-    df_sch_prod_dim = spark.sql(f"SELECT * FROM {catalog_name}.gold_tp.tp_prod_dim limit 0")
+# Product hierarchy columns rolled up per (pg_categ_txt, pg_super_categ_txt) by acn_prod_trans,
+# per srce_sys_id; sources without an entry use 'default'.
+# base_desc_txt, pg_gbu_txt and pg_sku_base_size_txt are not rolled up for any source yet.
+PROD_ROLLUP_COLS = {
+    'default': [
+        'pg_brand_txt', 'pg_conc_txt', 'pg_grp_size_txt', 'pg_mfgr_txt', 'pg_mega_categ_txt',
+        'pg_sectr_txt', 'pg_seg_txt', 'pg_sku_base_desc_txt', 'pg_sku_num_txt',
+        'pg_sub_brand_txt', 'pg_sub_mfgr_txt',
+    ],
+}
+
+def rollup_cols_for(srce_sys_id, config=PROD_ROLLUP_COLS):
+    # Columns to roll up for the source system, see PROD_ROLLUP_COLS
+    return config.get(srce_sys_id, config.get(str(srce_sys_id), config['default']))
+
+def unique_or_null_agg(df, group_cols, value_cols, strict=False):
+    """
+    Aggregates df by group_cols, keeping each of value_cols when it has a single value
+    in the group and NULL otherwise.
+
+    MIN and MAX are computed in the same aggregation and the value is kept when they are
+    equal, which is much cheaper than a COUNT(DISTINCT x) = 1 check per column.
+
+    Parameters:
+    df (DataFrame): The rows to roll up.
+    group_cols (list): The grouping keys.
+    value_cols (list): The columns to roll up.
+    strict (bool): Also return NULL when the group mixes the value with NULLs.
+        By default NULLs are ignored, like COUNT(DISTINCT x).
+
+    Returns:
+    DataFrame: One row per group with group_cols followed by value_cols.
+    """
+    aggs = []
+    for c in value_cols:
+        condition = f"MIN({c}) = MAX({c})"
+        if strict:
+            condition += f" AND COUNT({c}) = COUNT(1)"
+        aggs.append(expr(f"CASE WHEN {condition} THEN MIN({c}) END").alias(c))
+    if not aggs:
+        return df.select(*group_cols).distinct()
+    return df.groupBy(*group_cols).agg(*aggs)
 
-    # Create a temporary view from the complemented DataFrame
-    df_sch_prod_dim.createOrReplaceTempView("df_sch_prod_dim")
-    query = f""" select a.*except(a.run_id,a.prod_skid,a.cntrt_id, a.srce_sys_id, a.part_srce_sys_id) from df_sch_prod_dim a"""
-    df_sch_prod_dim = spark.sql(query)
+############################################################################################
+
+# Seconds a cached target table schema is used before it is read again
+SCHEMA_REGISTRY_TTL_SECONDS = 600
+
+class SchemaRegistry:
+    """
+    Driver-side cache of target table schemas, so aligning a DataFrame to a table does not
+    resolve the table on every call. A schema is read again once it is older than ttl
+    seconds, or after invalidate(table); writers that may change a schema call the latter.
+    """
+    def __init__(self, ttl=SCHEMA_REGISTRY_TTL_SECONDS):
+        self.ttl = ttl
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def schema(self, table):
+        with self._lock:
+            cached = self._schemas.get(table)
+            if cached is not None and monotonic() - cached[0] < self.ttl:
+                return cached[1]
+        schema = get_spark().table(table).schema
+        with self._lock:
+            self._schemas[table] = (monotonic(), schema)
+        return schema
+
+    def invalidate(self, table=None):
+        # Drops the cached schema of table, or of every table
+        with self._lock:
+            if table is None:
+                self._schemas.clear()
+            else:
+                self._schemas.pop(table, None)
+
+# Shared registry used by acn_prod_trans and t2_publish_product
+schema_registry = SchemaRegistry()
+
+def align_to_schema(df, schema, exclude=(), cast_existing=True):
+    """
+    Aligns df with a target schema in a single select, in place of a unionByName with an
+    empty read of the target table, which adds a Union to every downstream plan.
+
+    df's columns keep their order and are cast to the target type where the target has
+    them; target columns missing from df are appended as typed NULLs. Column names match
+    case-insensitively. df is returned as is when it already matches.
+
+    Parameters:
+    df (DataFrame): The DataFrame to align.
+    schema (StructType): The target schema, e.g. schema_registry.schema(table).
+    exclude (iterable): Target columns not to add.
+    cast_existing (bool): Cast df's columns to the target types. Pass False for raw input
+        that is standardized after the alignment, so only missing columns are added.
+    """
+    excluded = {name.lower() for name in exclude}
+    fields = {f.name.lower(): f for f in schema.fields if f.name.lower() not in excluded}
+    present = set()
+    projection = []
+    changed = False
+    for name, dtype in df.dtypes:
+        present.add(name.lower())
+        field = fields.get(name.lower())
+        if cast_existing and field is not None and field.dataType.simpleString() != dtype:
+            projection.append(F.col(f"`{name}`").cast(field.dataType).alias(name))
+            changed = True
+        else:
+            projection.append(F.col(f"`{name}`"))
+    for key, field in fields.items():
+        if key not in present:
+            projection.append(F.lit(None).cast(field.dataType).alias(field.name))
+            changed = True
+    return df.select(*projection) if changed else df
+
+# Bloom filter index options: false positive rate, and distinct values expected per file
+BLOOM_FILTER_FPP = 0.1
+BLOOM_FILTER_NUM_ITEMS = 5_000_000
+
+# (table, column) pairs already checked by ensure_bloom_filter_index on this driver
+_bloom_filter_indexed = set()
+
+def ensure_bloom_filter_index(table, column, fpp=BLOOM_FILTER_FPP, num_items=BLOOM_FILTER_NUM_ITEMS):
+    """
+    Creates a Databricks bloom filter index on an external id column, unless it exists.
+
+    Every file written to the table afterwards, e.g. by each publish MERGE, carries a bloom
+    filter of the column, so key lookups skip the files that cannot hold the key. Files
+    written before are indexed when they are rewritten. In a table partitioned on the
+    source system, each filter covers one source's keys.
+    The index is an optimization: a failure is logged and not raised.
+
+    Returns:
+    bool: True if the index was created by this call.
+    """
+    key = (table, column.lower())
+    if key in _bloom_filter_indexed:
+        return False
+    _bloom_filter_indexed.add(key)
+    try:
+        field = next((f for f in get_spark().table(table).schema.fields if f.name.lower() == column.lower()), None)
+        if field is None:
+            print(f"No column {column} in {table}, bloom filter index not created")
+            return False
+        if field.metadata.get("delta.bloomFilter.enabled"):
+            return False
+        get_spark().sql(f"""
+            CREATE BLOOMFILTER INDEX ON TABLE {table}
+            FOR COLUMNS({field.name} OPTIONS (fpp={fpp}, numItems={int(num_items)}))
+        """)
+        print(f"Bloom filter index created on {table}.{field.name}")
+        return True
+    except Exception as e:
+        print(f"Bloom filter index on {table}.{column} not created: {e}")
+        return False
+
+############################################################################################
+
+def acn_prod_trans(srce_sys_id, TIME_PERD_TYPE_CODE, observation=None):
+    """
+    Standardizes the materialised product extract of the run into new tp_prod_dim rows.
+
+    The result is returned unevaluated, so the raw file is read once, by whatever action
+    the caller runs on it. To log the raw row count, pass a pyspark.sql.Observation and
+    read observation.get['raw_row_count'] after that action.
+    """
+    # Read PROD_DIM schema from Delta Table
+    prod_dim_schema = schema_registry.schema(f"{catalog_name}.gold_tp.tp_prod_dim")
     # Read the Product parquet file into DataFrame
-    df_rawfile_input = spark.read.parquet(f"/mnt/tp-source-data/temp/materialised/{RUN_ID}/load_product_df_prod_extrn")
-    print("Product row count from Raw file: "+str(df_rawfile_input.count())+"\n\n")
+    df_rawfile_input = get_spark().read.parquet(f"/mnt/tp-source-data/temp/materialised/{RUN_ID}/load_product_df_prod_extrn")
+    if observation is not None:
+        # Counted while the result is computed instead of by a separate scan
+        df_rawfile_input = df_rawfile_input.observe(observation, F.count(F.lit(1)).alias("raw_row_count"))
 
-    # Complement the columns of df_rawfile_input with those in tp_prod_dim
-    df_rawfile_input = df_rawfile_input.unionByName(df_sch_prod_dim,allowMissingColumns=True)
+    # Complement the columns of df_rawfile_input with those in tp_prod_dim; the raw columns
+    # stay strings until they are standardized below
+    df_rawfile_input = align_to_schema(df_rawfile_input, prod_dim_schema, exclude=("run_id", "prod_skid", "cntrt_id", "srce_sys_id", "part_srce_sys_id"), cast_existing=False)
 
     df_rawfile_input = df_rawfile_input.withColumn('last_sellg_txt',date_format(when(trim(col('last_sellg_txt')) == 'NOT APPLICABLE', '1991-04-15').otherwise(trim(col('last_sellg_txt'))), 'yyyy-MM-dd'))
 
     df_rawfile_input.createOrReplaceTempView("df_rawfile_input")
 
     # Remove the duplicates from the df_rawfile_input DataFrame
-    df_final = spark.sql("""
+    df_final = get_spark().sql("""
     WITH row_deduplicated AS (
         SELECT *,
             ROW_NUMBER() OVER (
@@ -117,60 +553,21 @@ def acn_prod_trans(srce_sys_id, TIME_PERD_TYPE_CODE ):
 
     # Grouping the Product Data
     # Aggregate the Product Data and Grouping by pg_categ_txt, pg_super_categ_txt
-    df_agg = df.groupBy("pg_categ_txt", "pg_super_categ_txt").agg(
-        # expr(
-        #     "CASE WHEN COUNT(DISTINCT base_desc_txt) = 1 THEN MIN(base_desc_txt) ELSE NULL END"
-        # ).alias("base_desc_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_brand_txt) = 1 THEN MIN(pg_brand_txt) ELSE NULL END"
-        ).alias("pg_brand_txt"),
-        # expr(
-        #     "CASE WHEN COUNT(DISTINCT pg_gbu_txt) =1 THEN MIN( pg_gbu_txt) ELSE NULL END"
-        # ).alias("pg_gbu_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_conc_txt) =1 THEN MIN( pg_conc_txt) ELSE NULL END"
-        ).alias("pg_conc_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_grp_size_txt) =1 THEN MIN( pg_grp_size_txt) ELSE NULL END"
-        ).alias("pg_grp_size_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_mfgr_txt) =1 THEN MIN( pg_mfgr_txt) ELSE NULL END"
-        ).alias("pg_mfgr_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_mega_categ_txt) =1 THEN MIN( pg_mega_categ_txt) ELSE NULL END"
-        ).alias("pg_mega_categ_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_sectr_txt) =1 THEN MIN( pg_sectr_txt) ELSE NULL END"
-        ).alias("pg_sectr_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_seg_txt) =1 THEN MIN( pg_seg_txt) ELSE NULL END"
-        ).alias("pg_seg_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_sku_base_desc_txt) =1 THEN MIN( pg_sku_base_desc_txt) ELSE NULL END"
-        ).alias("pg_sku_base_desc_txt"),
-        # expr(
-        #     "CASE WHEN COUNT(DISTINCT pg_sku_base_size_txt) =1 THEN MIN( pg_sku_base_size_txt) ELSE NULL END"
-        # ).alias("pg_sku_base_size_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_sku_num_txt) =1 THEN MIN( pg_sku_num_txt) ELSE NULL END"
-        ).alias("pg_sku_num_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_sub_brand_txt) =1 THEN MIN( pg_sub_brand_txt) ELSE NULL END"
-        ).alias("pg_sub_brand_txt"),
-        expr(
-            "CASE WHEN COUNT(DISTINCT pg_sub_mfgr_txt) =1 THEN MIN( pg_sub_mfgr_txt) ELSE NULL END"
-        ).alias("pg_sub_mfgr_txt")
-    )
+    df_agg = unique_or_null_agg(df, ["pg_categ_txt", "pg_super_categ_txt"], rollup_cols_for(srce_sys_id))
 
     # Complementing df with df_agg
     df = df.unionByName(df_agg,allowMissingColumns=True)
 
 
+    ensure_bloom_filter_index(f"{catalog_name}.internal_tp.tp_prod_sdim", "extrn_prod_id")
+
     # Standardize the product data and add the key columns RUN_ID and srce_sys_id.
+    # Only products not yet in tp_prod_sdim are kept, so their prod_skid is always NULL;
+    # the anti join reads just the key columns of the source's sdim partition.
     df.createOrReplaceTempView("df")
-    df = spark.sql(f"""
+    df = get_spark().sql(f"""
     SELECT 
-    ref_df.prod_skid,
+    CAST(NULL AS BIGINT) AS prod_skid,
     in_df.* 
     FROM (
     SELECT 
@@ -189,20 +586,21 @@ def acn_prod_trans(srce_sys_id, TIME_PERD_TYPE_CODE ):
         * 
     FROM df
     ) AS in_df
-    LEFT OUTER JOIN (
-    SELECT * 
+    LEFT ANTI JOIN (
+    SELECT extrn_prod_id, srce_sys_id 
     FROM {catalog_name}.internal_tp.tp_prod_sdim
     WHERE part_srce_sys_id = {srce_sys_id} 
     ) AS ref_df
     ON in_df.extrn_prod_id == ref_df.extrn_prod_id  and in_df.srce_sys_id =ref_df.srce_sys_id
-    where ref_df.extrn_prod_id IS NULL
     """)
+    return df
 
 ##########################################################################
 
 def t2_publish_product(df,catalog_name,schema_name, prod_dim):
-    df_connect_mm_prod_dim_vw = spark.sql(f"SELECT * FROM {catalog_name}.{schema_name}.{prod_dim} limit 0")
-    df = df.unionByName(df_connect_mm_prod_dim_vw,allowMissingColumns=True)
+    df = align_to_schema(df, schema_registry.schema(f"{catalog_name}.{schema_name}.{prod_dim}"))
+    # Files written by the MERGE below then carry a bloom filter of the external ids
+    ensure_bloom_filter_index(f"{catalog_name}.{schema_name}.{prod_dim}", "extrn_prod_id")
     df.createOrReplaceTempView("df_mm_prod_sdim_promo_vw")
 
     merge_sql_sdim = f"""
@@ -214,50 +612,202 @@ def t2_publish_product(df,catalog_name,schema_name, prod_dim):
     WHEN NOT MATCHED THEN
     INSERT *
     """
-    spark.sql(merge_sql_sdim)
+    get_spark().sql(merge_sql_sdim)
+    # The MERGE may have evolved the table's schema
+    schema_registry.invalidate(f"{catalog_name}.{schema_name}.{prod_dim}")
 
 #############################################################################
 
-def release_semaphore(catalog_name,run_id,lock_path ):
-    spark.sql(f"DELETE FROM {catalog_name}.internal_tp.tp_run_lock_plc WHERE run_id = {run_id} AND lock_path IN ({lock_path})")
+def _is_write_conflict(e):
+    # Delta reports a lost write conflict as a Concurrent*Exception
+    return "Concurrent" in type(e).__name__ or "Concurrent" in str(e)
+
+def _retry_write_conflict(write, what):
+    # Runs a Delta lock table write, retrying up to LOCK_MERGE_RETRIES times when it loses a write conflict
+    for attempt in range(1, LOCK_MERGE_RETRIES + 1):
+        try:
+            return write()
+        except Exception as e:
+            if not _is_write_conflict(e) or attempt == LOCK_MERGE_RETRIES:
+                raise
+            print(f"{what} lost a write conflict (attempt {attempt})")
+            time.sleep(random.uniform(0, LOCK_POLL_INITIAL))
+
+def release_semaphore(catalog_name,run_id,lock_path, backend=None):
+    stop_lock_heartbeat(run_id, lock_path)
+    if (backend or LOCK_BACKEND) == "postgres":
+        with postgres_transaction() as cursor:
+            cursor.execute(f"DELETE FROM {postgres_schema}.tp_run_lock_plc WHERE run_id = %s AND lock_path IN ({lock_path})", (run_id,))
+    else:
+        _retry_write_conflict(
+            lambda: get_spark().sql(f"DELETE FROM {catalog_name}.internal_tp.tp_run_lock_plc WHERE run_id = {run_id} AND lock_path IN ({lock_path})"),
+            f"Lock release for run {run_id}",
+        )
+    _notify_lock_released()
+
+# Runs waiting in check_lock on this driver are woken up by every release_semaphore
+_lock_release_cond = threading.Condition()
+_lock_release_seq = 0
+
+def _notify_lock_released():
+    global _lock_release_seq
+    with _lock_release_cond:
+        _lock_release_seq += 1
+        _lock_release_cond.notify_all()
+
+def _wait_for_lock_release(seen_seq, timeout):
+    # Sleep up to timeout seconds, returning True early if a release happened since seen_seq
+    with _lock_release_cond:
+        return _lock_release_cond.wait_for(lambda: _lock_release_seq != seen_seq, timeout)
+
+# Heartbeat threads renewing lock leases, keyed on (run_id, lock_path) as passed to release_semaphore
+_lock_heartbeats = {}
+_lock_heartbeats_guard = threading.Lock()
+
+def _heartbeat_key(run_id, lock_path):
+    # run_id arrives as int or as a notebook widget string
+    return (str(run_id), str(lock_path))
+
+def start_lock_heartbeat(RUN_ID, check_path, backend=None, lease_seconds=LOCK_LEASE_SECONDS):
+    """
+    Starts a daemon thread renewing the lease on the run's lock rows every lease_seconds / 3,
+    until release_semaphore is called for the same paths. If the driver dies the renewals stop
+    and the locks expire, so waiting runs are not blocked by a crashed run.
+    A failed renewal is logged and retried on the next beat; after LOCK_HEARTBEAT_MAX_FAILURES
+    failures in a row the heartbeat stops with a RuntimeError, as the lease is about to lapse.
+    """
+    stop_lock_heartbeat(RUN_ID, check_path)
+    stop = threading.Event()
+
+    def heartbeat():
+        failures = 0
+        while not stop.wait(lease_seconds / 3):
+            try:
+                renew_lock_lease(RUN_ID, check_path, backend, lease_seconds)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                print(f"Lock heartbeat for run {RUN_ID} failed ({failures}/{LOCK_HEARTBEAT_MAX_FAILURES}): {e}")
+                if failures >= LOCK_HEARTBEAT_MAX_FAILURES:
+                    raise RuntimeError(f"Lock lease of run {RUN_ID} on {check_path} could not be renewed and will lapse") from e
+
+    thread = threading.Thread(target=heartbeat, name=f"lock-heartbeat-{RUN_ID}", daemon=True)
+    with _lock_heartbeats_guard:
+        _lock_heartbeats[_heartbeat_key(RUN_ID, check_path)] = (thread, stop)
+    thread.start()
+    return thread
+
+def stop_lock_heartbeat(run_id, lock_path):
+    # Stops the heartbeat of the run's paths, if one is running
+    with _lock_heartbeats_guard:
+        entry = _lock_heartbeats.pop(_heartbeat_key(run_id, lock_path), None)
+    if entry is not None:
+        entry[1].set()
+
+def renew_lock_lease(RUN_ID, check_path, backend=None, lease_seconds=LOCK_LEASE_SECONDS):
+    # Pushes the lease expiry of the run's lock rows lease_seconds into the future
+    if (backend or LOCK_BACKEND) == "postgres":
+        with postgres_transaction() as cursor:
+            cursor.execute(
+                f"UPDATE {postgres_schema}.tp_run_lock_plc SET lease_expiry = clock_timestamp() + make_interval(secs => %s) "
+                f"WHERE run_id = %s AND lock_path IN ({check_path})",
+                (lease_seconds, RUN_ID)
+            )
+    else:
+        _retry_write_conflict(
+            lambda: get_spark().sql(f"""
+                UPDATE {catalog_name}.internal_tp.tp_run_lock_plc
+                SET lease_expiry = current_timestamp() + INTERVAL {int(lease_seconds)} SECONDS
+                WHERE run_id = {RUN_ID} AND lock_path IN ({check_path})
+            """),
+            f"Lock lease renewal for run {RUN_ID}",
+        )
+
+def reclaim_expired_locks(catalog_name, backend=None):
+    """
+    Deletes lock rows whose lease has expired, i.e. rows left behind by runs that died
+    without calling release_semaphore. Rows without a lease never expire.
+    Waiting runs are only woken up when rows were reclaimed.
+    """
+    if (backend or LOCK_BACKEND) == "postgres":
+        with postgres_transaction() as cursor:
+            cursor.execute(f"DELETE FROM {postgres_schema}.tp_run_lock_plc WHERE lease_expiry < clock_timestamp()")
+            reclaimed = cursor.rowcount
+    else:
+        row = _retry_write_conflict(
+            lambda: get_spark().sql(f"DELETE FROM {catalog_name}.internal_tp.tp_run_lock_plc WHERE lease_expiry < current_timestamp()").first(),
+            "Expired lock reclaim",
+        )
+        reclaimed = row["num_affected_rows"] if row is not None else None
+    if reclaimed:
+        _notify_lock_released()
+    return reclaimed
 
 ############################################################################
 
-def read_from_postgres(object_name):
+def read_from_postgres(object_name, partition_column=None, lower_bound=None, upper_bound=None, num_partitions=None, fetchsize=None, where=None):
     """
     Reads data from a PostgreSQL table into a Spark DataFrame.
     
     Parameters:
     object_name (str): The name of the table to read from.
+    partition_column (str): Optional numeric, date or timestamp column to split the read on,
+        so that num_partitions executors read the table in parallel.
+    lower_bound, upper_bound: Range of partition_column used to compute the partition strides.
+        When not given they are looked up with MIN/MAX on the table.
+    num_partitions (int): Number of parallel reads, defaults to the cluster's default parallelism.
+    fetchsize (int): Rows fetched per round trip by each JDBC reader.
+    where (str): Optional filter evaluated by PostgreSQL, so only matching rows are transferred.
     
     Returns:
     DataFrame: A Spark DataFrame containing the data from the specified table.
     """
-    df = spark.read.format("jdbc") \
+    dbtable = object_name if where is None else f"(SELECT * FROM {object_name} WHERE {where}) AS src"
+    reader = get_spark().read.format("jdbc") \
         .option("driver", "org.postgresql.Driver") \
         .option("url", f"{refDBjdbcURL}/{refDBname}") \
-        .option("dbtable", f'''{object_name}''') \
+        .option("dbtable", f'''{dbtable}''') \
         .option("user", f"{refDBuser}") \
         .option("password", f"{refDBpwd}") \
         .option("ssl", True) \
         .option("sslmode", "require") \
-        .option("sslfactory", "org.postgresql.ssl.NonValidatingFactory") \
-        .load()
+        .option("sslfactory", "org.postgresql.ssl.NonValidatingFactory")
+    if fetchsize:
+        reader = reader.option("fetchsize", fetchsize)
+    if partition_column:
+        if lower_bound is None or upper_bound is None:
+            # Discover the missing bounds on the driver without a Spark job
+            where_clause = f" WHERE {where}" if where else ""
+            bounds = fetch_query_from_postgres(f"SELECT MIN({partition_column}) AS lower_bound, MAX({partition_column}) AS upper_bound FROM {object_name}{where_clause}")[0]
+            lower_bound = bounds['lower_bound'] if lower_bound is None else lower_bound
+            upper_bound = bounds['upper_bound'] if upper_bound is None else upper_bound
+        # An empty table has no bounds, read it as a single partition
+        if lower_bound is not None and upper_bound is not None:
+            reader = reader.option("partitionColumn", partition_column) \
+                .option("lowerBound", str(lower_bound)) \
+                .option("upperBound", str(upper_bound)) \
+                .option("numPartitions", num_partitions or get_spark().sparkContext.defaultParallelism)
+    df = reader.load()
     return df
 
 ############################################################################
 
-def read_query_from_postgres(query):
+def read_query_from_postgres(query, collect=False):
     """
     Reads data from a PostgreSQL table using a query into a Spark DataFrame.
     
     Parameters:
     query (str): The SQL query to execute.
+    collect (bool): Return the collected rows instead of a DataFrame. The query is then run
+        on the driver through psycopg2, skipping the Spark JDBC job for small lookups.
     
     Returns:
-    DataFrame: A Spark DataFrame containing the data using the query.
+    DataFrame: A Spark DataFrame containing the data using the query,
+        or a list of dict rows when collect is True.
     """
-    df = spark.read.format("jdbc") \
+    if collect:
+        return fetch_query_from_postgres(query)
+    df = get_spark().read.format("jdbc") \
         .option("driver", "org.postgresql.Driver") \
         .option("url", f"{refDBjdbcURL}/{refDBname}") \
         .option("query", query) \
@@ -271,37 +821,469 @@ def read_query_from_postgres(query):
 
 ############################################################################
 
-def write_to_postgres(df, object_name):
+def fetch_query_from_postgres(query, params=None, as_pandas=False):
+    """
+    Runs a query on the driver through psycopg2 and returns the result in memory.
+    Meant for lookups of a few rows, where a Spark JDBC read would cost a whole job.
+    
+    Parameters:
+    query (str): The SQL query to execute.
+    params (tuple or dict): Optional query parameters.
+    as_pandas (bool): Return a pandas DataFrame instead of a list of dict rows.
+    
+    Returns:
+    list or pandas.DataFrame: The rows returned by the query.
+    """
+    with postgres_transaction() as cursor:
+        cursor.execute(query, params)
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+
+    if as_pandas:
+        import pandas as pd
+        return pd.DataFrame.from_records(rows, columns=columns)
+    return [dict(zip(columns, row)) for row in rows]
+
+############################################################################
+
+def write_to_postgres(df, object_name, method="jdbc", num_partitions=None, batch_size=None, staging=False, overwrite=False):
     """
     Writes data from a Spark DataFrame to a PostgreSQL table.
     
     Parameters:
     df (DataFrame): The Spark DataFrame to write.
     object_name (str): The name of the table to write to.
+    method (str): "jdbc" appends through Spark's JDBC writer, "copy" streams every
+        partition into PostgreSQL with COPY ... FROM STDIN in CSV format.
+    num_partitions (int): Optional number of parallel writers (partitions/connections).
+    batch_size (int): Rows per INSERT batch for "jdbc", rows per COPY statement for "copy".
+    staging (bool): "copy" only. Load into a staging table first and publish it to
+        object_name in one transaction once every partition succeeded.
+    overwrite (bool): "copy" with staging only. Replace object_name by the staging table
+        (atomic rename swap) instead of appending to it. Serial and identity sequences
+        are carried over, grants and dependent views of the replaced table are not.
+    
+    Returns:
+    list: For "copy", one dict per partition with the rows and bytes written.
     """
-    df.write.format("jdbc") \
+    if method == "copy":
+        return _copy_dataframe_to_postgres(df, object_name, num_partitions, batch_size, staging, overwrite)
+
+    writer = df.write.format("jdbc") \
         .option("url", f"{refDBjdbcURL}/{refDBname}") \
         .option("dbtable", f'''{object_name}''') \
         .option("user", f"{refDBuser}") \
-        .option("password", f"{refDBpwd}") \
-        .mode("append") \
+        .option("password", f"{refDBpwd}")
+    if batch_size:
+        writer = writer.option("batchsize", batch_size) \
+            .option("reWriteBatchedInserts", "true")
+    if num_partitions:
+        writer = writer.option("numPartitions", num_partitions)
+    writer.mode("append") \
         .save()
+
+def _carry_over_sequences(cursor, old_table, new_table):
+    """
+    Keeps the key sequences of a table swapped out by an overwrite.
+
+    LIKE ... INCLUDING ALL copies serial defaults as nextval() on the old table's sequence,
+    which DROP TABLE would take with it, so ownership moves to the new table. Identity
+    columns get a fresh sequence, which is moved to the position of the old one.
+    """
+    cursor.execute("""
+        SELECT format('%%I.%%I', n.nspname, s.relname), a.attname, d.deptype
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_namespace n ON n.oid = s.relnamespace
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = %s::regclass AND d.deptype IN ('a', 'i')
+    """, (old_table,))
+    for sequence, column, deptype in cursor.fetchall():
+        if deptype == 'a':
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {new_table}.{column}")
+        else:
+            cursor.execute(f"SELECT last_value, is_called FROM {sequence}")
+            last_value, is_called = cursor.fetchone()
+            cursor.execute("SELECT setval(pg_get_serial_sequence(%s, %s), %s, %s)", (new_table, column, last_value, is_called))
+
+def _copy_dataframe_to_postgres(df, object_name, num_partitions, batch_size, staging, overwrite):
+    if num_partitions:
+        current_partitions = df.rdd.getNumPartitions()
+        df = df.coalesce(num_partitions) if num_partitions < current_partitions else df.repartition(num_partitions)
+
+    target_table = object_name
+    if staging:
+        target_table = f"{object_name}_stg_{uuid.uuid4().hex[:8]}"
+        with postgres_transaction() as cursor:
+            cursor.execute(f"CREATE TABLE {target_table} (LIKE {object_name} INCLUDING ALL)")
+
+    # Executors open their own connections, the driver-side pool is not shipped to them
+    connect_kwargs = _postgres_connect_kwargs()
+    copy_sql = _copy_sql(target_table, df.columns)
+
+    def copy_partition(index, rows):
+        conn = psycopg2.connect(**connect_kwargs)
+        report = {'partition': index, 'rows': 0, 'bytes': 0}
+        try:
+            cursor = conn.cursor()
+            rows = iter(rows)
+            while True:
+                batch = list(islice(rows, batch_size)) if batch_size else rows
+                if batch_size and not batch:
+                    break
+                stream = _CsvCopyStream(tuple(row) for row in batch)
+                cursor.copy_expert(copy_sql, stream)
+                report['rows'] += stream.rows_written
+                report['bytes'] += stream.bytes_written
+                if not batch_size:
+                    break
+            conn.commit()
+        finally:
+            conn.close()
+        yield report
+
+    try:
+        report = df.rdd.mapPartitionsWithIndex(copy_partition).collect()
+        if staging:
+            with postgres_transaction() as cursor:
+                if overwrite:
+                    schema_prefix, _, table = object_name.rpartition('.')
+                    old_table = f"{table}_old_{uuid.uuid4().hex[:8]}"
+                    old_object = f"{schema_prefix + '.' if schema_prefix else ''}{old_table}"
+                    cursor.execute(f"ALTER TABLE {object_name} RENAME TO {old_table}")
+                    cursor.execute(f"ALTER TABLE {target_table} RENAME TO {table}")
+                    _carry_over_sequences(cursor, old_object, object_name)
+                    cursor.execute(f"DROP TABLE {old_object}")
+                else:
+                    cursor.execute(f"INSERT INTO {object_name} SELECT * FROM {target_table}")
+                    cursor.execute(f"DROP TABLE {target_table}")
+    except Exception:
+        if staging:
+            try:
+                with postgres_transaction() as cursor:
+                    cursor.execute(f"DROP TABLE IF EXISTS {target_table}")
+            except Exception as cleanup_error:
+                print(f"Could not drop staging table {target_table}: {cleanup_error}")
+        raise
+
+    print(f"Copied {sum(r['rows'] for r in report)} rows ({sum(r['bytes'] for r in report)} bytes) into {object_name} from {len(report)} partitions")
+    return report
     
 ############################################################################
 
-def update_to_postgres(query):
-    conn = psycopg2.connect(
+def _postgres_connect_kwargs():
+    # Connection arguments shared by every psycopg2 connection to the reference database
+    return dict(
         dbname=refDBname,
         user=refDBuser,
         password=refDBpwd,
-        host="psql-pg-flex-tpconsole-dev-1.postgres.database.azure.com",
+        host=REF_DB_HOST,
         sslmode='require'
     )
-    cursor = conn.cursor()
-    cursor.execute(query)
-    conn.commit()
-    cursor.close()
-    conn.close()
+
+def _rows_as_dicts(cursor):
+    # Turn the pending result of a psycopg2 cursor into a list of column -> value dicts
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+############################################################################
+
+class _PostgresPool:
+    """
+    Thread-safe pool of psycopg2 connections to the reference database.
+
+    Idle connections are health checked on checkout and replaced when they are
+    closed or fail a ping, so a dropped connection costs one reconnect instead of an error.
+    """
+    def __init__(self, minconn, maxconn, connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.connect_kwargs = connect_kwargs
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        for _ in range(minconn):
+            self._idle.append((psycopg2.connect(**connect_kwargs), monotonic()))
+            self._size += 1
+
+    def getconn(self, timeout=None):
+        timeout = PG_POOL_TIMEOUT if timeout is None else timeout
+        deadline = monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reserve a slot and connect outside the lock
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(f"No PostgreSQL connection available after {timeout}s")
+                self._cond.wait(remaining)
+
+        if conn is not None:
+            if self._healthy(conn, last_used):
+                return conn
+            self._close_quietly(conn)
+        try:
+            return psycopg2.connect(**self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            self._close_quietly(conn)
+        with self._cond:
+            if close or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def _healthy(self, conn, last_used):
+        if conn.closed != 0:
+            return False
+        if monotonic() - last_used < PG_POOL_PING_AFTER:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+def configure_postgres_pool(minconn=None, maxconn=None, host=None):
+    """
+    Changes the pool settings (and optionally the database host). The current pool
+    is closed and a new one is created with the new settings on next use.
+    """
+    global PG_POOL_MINCONN, PG_POOL_MAXCONN, REF_DB_HOST
+    if minconn is not None:
+        PG_POOL_MINCONN = minconn
+    if maxconn is not None:
+        PG_POOL_MAXCONN = maxconn
+    if host is not None:
+        REF_DB_HOST = host
+    close_postgres_pool()
+
+def get_postgres_pool():
+    # Create the pool on first use, or again when the connection settings changed
+    global _pg_pool
+    connect_kwargs = _postgres_connect_kwargs()
+    with _pg_pool_lock:
+        if _pg_pool is not None and _pg_pool.connect_kwargs != connect_kwargs:
+            _pg_pool.closeall()
+            _pg_pool = None
+        if _pg_pool is None:
+            _pg_pool = _PostgresPool(PG_POOL_MINCONN, PG_POOL_MAXCONN, connect_kwargs)
+        return _pg_pool
+
+def close_postgres_pool():
+    global _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+
+@contextmanager
+def postgres_transaction():
+    """
+    Checks a pooled connection out for the duration of a with-block and yields a cursor.
+    All statements run in one transaction, committed when the block exits normally and
+    rolled back on an exception. Connections that fail at the network level are
+    discarded so that the next checkout reconnects.
+
+    Example:
+    with postgres_transaction() as cursor:
+        cursor.execute("UPDATE ...")
+        cursor.execute("INSERT ...")
+    """
+    pool = get_postgres_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        finally:
+            cursor.close()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+############################################################################
+
+def update_to_postgres(query):
+    with postgres_transaction() as cursor:
+        cursor.execute(query)
+
+############################################################################
+
+def _deallocate_after_rollback(conn, stmt_name):
+    # Best effort: a connection that fails here is discarded by postgres_transaction
+    try:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DEALLOCATE {stmt_name}")
+    except psycopg2.Error:
+        pass
+
+def _positional_placeholders(query, num_params):
+    # Rewrites the %s placeholders of query to $1..$n and %% to %, in a single pass so that
+    # a placeholder right after an escaped percent ('%%%s') is still rewritten
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group() == '%%':
+            return '%'
+        count += 1
+        return f'${count}'
+
+    positional_query = re.sub(r'%%|%s', replace, query)
+    if count != num_params:
+        raise ValueError(f"Query has {count} placeholder(s) but the parameter tuples have {num_params} value(s)")
+    return positional_query
+
+def execute_many_to_postgres(query, params_list, page_size=1000, prepared=True):
+    """
+    Runs one statement for every parameter tuple in params_list in a single transaction,
+    sending page_size executions per network round trip.
+    
+    Parameters:
+    query (str): Statement with positional %s placeholders,
+        e.g. "UPDATE t SET sttus = %s WHERE file_name = %s".
+    params_list (iterable): One tuple of parameters per execution.
+    page_size (int): Number of executions sent per round trip.
+    prepared (bool): Prepare the statement on the server once and execute the plan for every tuple.
+    
+    Returns:
+    int: The number of parameter tuples executed.
+    """
+    params_list = [tuple(params) for params in params_list]
+    if not params_list:
+        return 0
+    if prepared:
+        # Server-side prepared statement: PREPARE takes $n placeholders
+        positional_query = _positional_placeholders(query, len(params_list[0]))
+    with postgres_transaction() as cursor:
+        if prepared:
+            stmt_name = f"tp_stmt_{uuid.uuid4().hex}"
+            cursor.execute(f"PREPARE {stmt_name} AS {positional_query}")
+            placeholders = ', '.join(['%s'] * len(params_list[0]))
+            try:
+                execute_batch(cursor, f"EXECUTE {stmt_name} ({placeholders})", params_list, page_size=page_size)
+            except BaseException:
+                # A rollback does not undo PREPARE, so drop the statement from the pooled
+                # connection once the failed transaction is rolled back
+                _deallocate_after_rollback(cursor.connection, stmt_name)
+                raise
+            cursor.execute(f"DEALLOCATE {stmt_name}")
+        else:
+            execute_batch(cursor, query, params_list, page_size=page_size)
+    return len(params_list)
+
+############################################################################
+
+class _CsvCopyStream:
+    """
+    File-like object that feeds rows to COPY ... FROM STDIN as CSV lines on demand,
+    so large inserts are streamed instead of built in memory. NULLs are sent as \\N.
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._pending = ''
+        self._line = io.StringIO()
+        self._writer = csv.writer(self._line, lineterminator='\n')
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    def _format(self, row):
+        self._line.seek(0)
+        self._line.truncate()
+        self._writer.writerow(['\\N' if value is None else value for value in row])
+        return self._line.getvalue()
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        while size is None or size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = self._format(row)
+            chunks.append(line)
+            length += len(line)
+            self.rows_written += 1
+        data = ''.join(chunks)
+        if size is not None and size >= 0:
+            data, self._pending = data[:size], data[size:]
+        else:
+            self._pending = ''
+        self.bytes_written += len(data.encode('utf-8'))
+        return data
+
+def _copy_sql(object_name, columns):
+    column_list = f" ({', '.join(columns)})" if columns else ''
+    return f"COPY {object_name}{column_list} FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+def copy_to_postgres(object_name, rows, columns=None):
+    """
+    Bulk loads rows into a PostgreSQL table with COPY ... FROM STDIN.
+    Much faster than INSERT statements for large row counts.
+    
+    Parameters:
+    object_name (str): The name of the table to load.
+    rows (iterable): Tuples of column values, consumed lazily.
+    columns (list): Optional target column names, in the order of the tuple values.
+    
+    Returns:
+    int: The number of rows copied.
+    """
+    stream = _CsvCopyStream(rows)
+    with postgres_transaction() as cursor:
+        cursor.copy_expert(_copy_sql(object_name, columns), stream)
+    return stream.rows_written
 
 ##############################################################################
 
@@ -341,14 +1323,14 @@ def add_secure_group_key(df, cntrt_id):
     WHERE cntrt_id = '{cntrt_id}'
     """
     # Execute the query and collect the secure_group_key
-    SGK_cntrt_id = read_query_from_postgres(SGK_cntrt_id).collect() # type: ignore
+    SGK_cntrt_id = lookup_cache.get_or_load('mm_cntrt_secur_grp_key_assoc_vw', SGK_cntrt_id, lambda: read_query_from_postgres(SGK_cntrt_id, collect=True)) # type: ignore
 
     SGK_default = f"""
         SELECT secure_group_key
         FROM {postgres_schema}.mm_secur_grp_key_lkp
         WHERE secur_grp_key_id IS NULL
         """
-    SGK_default = read_query_from_postgres(SGK_default).collect() # type: ignore
+    SGK_default = lookup_cache.get_or_load('mm_secur_grp_key_lkp', SGK_default, lambda: read_query_from_postgres(SGK_default, collect=True)) # type: ignore
 
     # Check if a secure_group_key was found for the given contract ID
     if SGK_cntrt_id and SGK_cntrt_id[0]['secure_group_key'] is not None:
@@ -541,118 +1523,652 @@ def work_to_arch(RUN_ID,CNTRT_ID,FILE_NAME):
 
 ############################################################################
 
+LOCK_MODES = ('shared', 'exclusive')
+
+def _normalize_lock_paths(paths):
+    """
+    Turns the PATHS argument of semaphore_acquisition into (lock_path, lock_mode) pairs.
+    A plain string is an exclusive lock; a (path, mode) tuple picks the mode, "shared"
+    for stages that only read the path or "exclusive" for stages that write it.
+    Trailing slashes are dropped, so stored lock paths can be compared as they are.
+    """
+    lock_paths = []
+    for path in paths:
+        path, mode = (path, 'exclusive') if isinstance(path, str) else path
+        if mode not in LOCK_MODES:
+            raise ValueError(f"Invalid lock mode {mode!r} for {path}, expected one of {LOCK_MODES}")
+        lock_paths.append((path.rstrip('/') or path, mode))
+    return lock_paths
+
+def _lock_conflict_sql(curr, tbl):
+    """
+    SQL condition (valid in Spark SQL and PostgreSQL) that is true when row tbl conflicts with row curr.
+    Paths conflict when they are equal or one is a parent directory of the other, so gold_tp
+    covers gold_tp/tp_prod_dim. Two shared locks never conflict.
+    """
+    curr_path = f"{curr}.lock_path"
+    tbl_path = f"{tbl}.lock_path"
+    return f"""({curr_path} = {tbl_path}
+            OR left({curr_path}, length({tbl_path}) + 1) = {tbl_path} || '/'
+            OR left({tbl_path}, length({curr_path}) + 1) = {curr_path} || '/')
+            AND NOT (COALESCE({curr}.lock_mode, 'exclusive') = 'shared' AND COALESCE({tbl}.lock_mode, 'exclusive') = 'shared')"""
+
+def _pg_lock_candidates_sql(tbl, paths):
+    """
+    Index-friendly PostgreSQL prefilter for _lock_conflict_sql: tbl.lock_path is one of paths
+    or one of their parent directories, or lies below one of them. Returns the condition and
+    its parameters. The LIKE prefixes use an index on lock_path built with text_pattern_ops.
+    """
+    ancestors = sorted({'/'.join(parts[:i]) for parts in (path.split('/') for path in paths) for i in range(1, len(parts) + 1)})
+    patterns = [path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '/%' for path in paths]
+    likes = ''.join(f" OR {tbl}.lock_path LIKE %s" for _ in patterns)
+    return f"({tbl}.lock_path = ANY(%s){likes})", [ancestors, *patterns]
+
+def _check_path_list(check_path):
+    # Paths of a check_path string as built by semaphore_queue ('a', 'b')
+    return re.findall(r"'([^']*)'", check_path)
+
 def semaphore_queue(RUN_ID,paths):
+    lock_paths = _normalize_lock_paths(paths)
     # Create a comma-separated string of paths
-    check_path = ', '.join(f"'{i}'" for i in paths)
+    check_path = ', '.join(f"'{path}'" for path, _ in lock_paths)
     # Create a DataFrame with the paths
-    paths_df = spark.createDataFrame([Row(lock_path=path) for path in paths])
+    paths_df = get_spark().createDataFrame([Row(lock_path=path, lock_mode=mode) for path, mode in lock_paths])
     
     # Add additional columns to the DataFrame
     paths_df = paths_df.withColumn("run_id", lit(RUN_ID).cast("bigint")) \
                        .withColumn("lock_sttus", lit(False)) \
-                       .withColumn("creat_date", current_timestamp())
+                       .withColumn("creat_date", current_timestamp()) \
+                       .withColumn("lease_expiry", expr(f"current_timestamp() + INTERVAL {LOCK_LEASE_SECONDS} SECONDS"))
     paths_df.createOrReplaceTempView("paths_df")
     # Insert data into the tp_run_lock_plc table
     table_name = f"{catalog_name}.internal_tp.tp_run_lock_plc"
-    paths_df.write.format("delta").mode("append").saveAsTable(table_name)
+    # mergeSchema adds lock_mode and lease_expiry to lock tables created before they existed
+    paths_df.write.format("delta").mode("append").option("mergeSchema", "true").saveAsTable(table_name)
     print("Data inserted successfully into", table_name)
     return check_path
 
 #############################################################################
 
-def check_lock(RUN_ID, check_path):
-    # Check for existing locks in the tp_run_lock_plc table
-    df = spark.sql(f"""
-        SELECT * 
-        FROM paths_df curr 
-        JOIN (
-            SELECT run_id, lock_path 
-            FROM {catalog_name}.internal_tp.tp_run_lock_plc 
-            QUALIFY ROW_NUMBER() OVER(PARTITION BY lock_path ORDER BY creat_date)=1
-        ) tbl 
-        ON curr.run_id != tbl.run_id AND tbl.lock_path = curr.lock_path
+def check_lock(RUN_ID, check_path, timeout=None, max_wait=LOCK_POLL_MAX_WAIT, return_metrics=False):
+    """
+    Waits until no other run holds or is queued before the current run on any of the
+    paths, then marks the current run's locks as acquired.
+
+    Between checks the wait grows exponentially with jitter up to max_wait seconds,
+    so concurrent waiters do not all hit the lock table together. The next check
+    is made immediately after a release_semaphore on this driver, or when fewer
+    runs block the paths than on the previous check.
+
+    Parameters:
+    RUN_ID: The current run ID.
+    check_path (str): Comma-separated, quoted lock paths as returned by semaphore_queue.
+    timeout (float): Seconds to wait in total before leaving the queue and raising
+        TimeoutError. None waits forever.
+    max_wait (float): Longest single wait between two checks.
+    return_metrics (bool): Return (check_path, metrics) instead of check_path.
+
+    Returns:
+    str: check_path, or (check_path, metrics) where metrics holds wait_seconds,
+        checks and max_blocked_paths for the acquisition.
+    """
+    return _wait_for_lock(
+        RUN_ID, check_path,
+        try_lock=lambda: _delta_try_lock(RUN_ID, check_path),
+        leave_queue=lambda: release_semaphore(catalog_name, RUN_ID, check_path),
+        reclaim=lambda: reclaim_expired_locks(catalog_name),
+        timeout=timeout, max_wait=max_wait, return_metrics=return_metrics,
+    )
+
+def _delta_try_lock(RUN_ID, check_path):
+    # Count the current run's paths blocked by a conflicting lock that is granted or queued earlier
+    # and whose lease has not expired
+    df = get_spark().sql(f"""
+        SELECT DISTINCT curr.lock_path
+        FROM {catalog_name}.internal_tp.tp_run_lock_plc curr
+        JOIN {catalog_name}.internal_tp.tp_run_lock_plc tbl
+        ON curr.run_id != tbl.run_id
+        AND {_lock_conflict_sql('curr', 'tbl')}
+        AND (tbl.lease_expiry IS NULL OR tbl.lease_expiry >= current_timestamp())
+        WHERE curr.run_id = {RUN_ID} AND curr.lock_path IN ({check_path})
+        AND (tbl.lock_sttus OR tbl.creat_date < curr.creat_date
+             OR (tbl.creat_date = curr.creat_date AND tbl.run_id < curr.run_id))
     """)
+    blockers = df.count()
 
     # If no locks are found, update the lock status to true
-    if df.count() == 0:
-        spark.sql(f"""
-            UPDATE {catalog_name}.internal_tp.tp_run_lock_plc 
-            SET lock_sttus = true 
-            WHERE run_id = {RUN_ID} AND lock_path IN ({check_path})
-        """)
-        print("Semaphore Acquired by the current process")
-        return check_path
-    else:
+    if blockers == 0:
+        _retry_write_conflict(
+            lambda: get_spark().sql(f"""
+                UPDATE {catalog_name}.internal_tp.tp_run_lock_plc 
+                SET lock_sttus = true 
+                WHERE run_id = {RUN_ID} AND lock_path IN ({check_path})
+            """),
+            f"Lock grant for run {RUN_ID}",
+        )
+    return blockers
+
+def _wait_for_lock(RUN_ID, check_path, try_lock, leave_queue, timeout, max_wait, return_metrics, reclaim=None):
+    # Backoff loop shared by the lock backends; try_lock returns the number of blocked paths.
+    # reclaim deletes expired locks; it runs once, the first time the run is blocked
+    started = monotonic()
+    checks = 0
+    max_blocked_paths = 0
+    last_blockers = None
+    delay = LOCK_POLL_INITIAL
+    while True:
+        with _lock_release_cond:
+            seen_seq = _lock_release_seq
+        checks += 1
+
+        blockers = try_lock()
+        if blockers == 0:
+            metrics = {'run_id': RUN_ID, 'wait_seconds': round(monotonic() - started, 3), 'checks': checks, 'max_blocked_paths': max_blocked_paths}
+            print(f"Semaphore Acquired by the current process after {metrics['wait_seconds']}s and {checks} checks")
+            return (check_path, metrics) if return_metrics else check_path
+
+        if last_blockers is None and reclaim is not None:
+            reclaim()
+        max_blocked_paths = max(max_blocked_paths, blockers)
+        if last_blockers is not None and blockers < last_blockers:
+            # Another run released part of the paths, check again soon
+            delay = LOCK_POLL_INITIAL
+        last_blockers = blockers
+
+        wait = min(delay, max_wait)
+        if timeout is not None:
+            remaining = timeout - (monotonic() - started)
+            if remaining <= 0:
+                # Leave the queue so that runs queued behind this one are not blocked
+                leave_queue()
+                raise TimeoutError(f"Run {RUN_ID} could not acquire the lock on {check_path} within {timeout}s")
+            wait = min(wait, remaining)
+
         # Wait for the lock to be released and retry
-        print('Waiting for lock')
-        time.sleep(30)
-        return check_lock(RUN_ID, check_path)
+        print(f'Waiting for lock on {blockers} path(s)')
+        if _wait_for_lock_release(seen_seq, random.uniform(wait / 2, wait)):
+            delay = LOCK_POLL_INITIAL
+        else:
+            delay = min(delay * LOCK_POLL_MULTIPLIER, max_wait)
+
+###############################################################################
+
+def pg_semaphore_queue(RUN_ID, paths):
+    """
+    Queues the run for the paths in the PostgreSQL lock table
+    {postgres_schema}.tp_run_lock_plc (run_id bigint, lock_path text, lock_mode text,
+    lock_sttus boolean, creat_date timestamptz, lease_expiry timestamptz, with an index on lock_path text_pattern_ops).
+    Same contract as semaphore_queue.
+    """
+    lock_paths = _normalize_lock_paths(paths)
+    check_path = ', '.join(f"'{path}'" for path, _ in lock_paths)
+    # All rows of the run share one creat_date, so two runs queuing overlapping paths are
+    # ordered the same way on every path (ties go to the lower run_id) and cannot deadlock
+    with postgres_transaction() as cursor:
+        cursor.execute(
+            f"INSERT INTO {postgres_schema}.tp_run_lock_plc (run_id, lock_path, lock_mode, lock_sttus, creat_date, lease_expiry) "
+            f"SELECT %s, lock_path, lock_mode, false, transaction_timestamp(), transaction_timestamp() + make_interval(secs => %s) "
+            f"FROM unnest(%s::text[], %s::text[]) AS t(lock_path, lock_mode)",
+            (RUN_ID, LOCK_LEASE_SECONDS, [path for path, _ in lock_paths], [mode for _, mode in lock_paths])
+        )
+    return check_path
+
+def pg_check_lock(RUN_ID, check_path, timeout=None, max_wait=LOCK_POLL_MAX_WAIT, return_metrics=False):
+    # Same contract as check_lock, against the PostgreSQL lock table
+    return _wait_for_lock(
+        RUN_ID, check_path,
+        try_lock=lambda: _pg_try_lock(RUN_ID, check_path),
+        leave_queue=lambda: release_semaphore(None, RUN_ID, check_path, backend="postgres"),
+        reclaim=lambda: reclaim_expired_locks(None, backend="postgres"),
+        timeout=timeout, max_wait=max_wait, return_metrics=return_metrics,
+    )
+
+def _pg_try_lock(RUN_ID, check_path):
+    # The advisory lock serializes check-and-grant, so two runs cannot both be granted a path.
+    # It is held only until the end of this transaction, i.e. a few milliseconds.
+    with postgres_transaction() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PG_LOCK_ADVISORY_KEY,))
+        candidates, candidate_params = _pg_lock_candidates_sql('tbl', _check_path_list(check_path))
+        cursor.execute(f"""
+            SELECT COUNT(DISTINCT curr.lock_path)
+            FROM {postgres_schema}.tp_run_lock_plc curr
+            JOIN {postgres_schema}.tp_run_lock_plc tbl
+            ON {candidates}
+            AND tbl.run_id != curr.run_id
+            AND {_lock_conflict_sql('curr', 'tbl')}
+            AND (tbl.lease_expiry IS NULL OR tbl.lease_expiry >= clock_timestamp())
+            WHERE curr.run_id = %s AND curr.lock_path IN ({check_path})
+            AND (tbl.lock_sttus OR tbl.creat_date < curr.creat_date
+                 OR (tbl.creat_date = curr.creat_date AND tbl.run_id < curr.run_id))
+        """, (*candidate_params, RUN_ID))
+        blockers = cursor.fetchone()[0]
+        if blockers == 0:
+            cursor.execute(f"UPDATE {postgres_schema}.tp_run_lock_plc SET lock_sttus = true WHERE run_id = %s AND lock_path IN ({check_path})", (RUN_ID,))
+    return blockers
     
 ###############################################################################
 
-def semaphore_acquisition(RUN_ID, PATHS):
+def try_acquire_semaphore(RUN_ID, PATHS, backend=None):
+    """
+    Grants the run all of PATHS in one atomic step if no other run holds or is queued for
+    a conflicting lock, without entering the queue otherwise.
+
+    On Delta this is a single MERGE into the lock table whose source only holds the paths
+    when nothing blocks them; Delta's optimistic concurrency rejects the MERGE if another
+    run changed the lock table meanwhile, in which case it is retried. On PostgreSQL the
+    check and the insert run in one transaction under the advisory lock.
+    The blocking run_ids are only looked up when the grant failed.
+
+    Parameters:
+    RUN_ID: The current run ID.
+    PATHS (list): Lock paths, or (lock_path, "shared" / "exclusive") tuples.
+    backend (str): Overrides LOCK_BACKEND.
+
+    Returns:
+    dict: granted (bool), blocking_run_ids (list) and check_path, the quoted paths to pass
+        to check_lock or release_semaphore.
+    """
+    lock_paths = _normalize_lock_paths(PATHS)
+    check_path = ', '.join(f"'{path}'" for path, _ in lock_paths)
+    if not lock_paths:
+        return {'granted': True, 'blocking_run_ids': [], 'check_path': check_path}
+    if (backend or LOCK_BACKEND) == "postgres":
+        blocking_run_ids = _pg_try_acquire(RUN_ID, lock_paths)
+        granted = not blocking_run_ids
+    else:
+        granted, blocking_run_ids = _delta_try_acquire(RUN_ID, lock_paths)
+    return {'granted': granted, 'blocking_run_ids': blocking_run_ids, 'check_path': check_path}
+
+def _delta_try_acquire(RUN_ID, lock_paths):
+    table = f"{catalog_name}.internal_tp.tp_run_lock_plc"
+    values = ', '.join(f"('{path}', '{mode}')" for path, mode in lock_paths)
+    blockers = f"""
+        SELECT tbl.run_id
+        FROM VALUES {values} AS req(lock_path, lock_mode)
+        JOIN {table} tbl
+        ON tbl.run_id != {RUN_ID}
+        AND {_lock_conflict_sql('req', 'tbl')}
+        AND (tbl.lease_expiry IS NULL OR tbl.lease_expiry >= current_timestamp())
+    """
+    for attempt in range(LOCK_MERGE_RETRIES):
+        try:
+            result = get_spark().sql(f"""
+                MERGE INTO {table} t
+                USING (
+                    SELECT lock_path, lock_mode
+                    FROM VALUES {values} AS req(lock_path, lock_mode)
+                    WHERE NOT EXISTS ({blockers})
+                ) s
+                ON t.run_id = {RUN_ID} AND t.lock_path = s.lock_path
+                WHEN MATCHED THEN UPDATE SET
+                    lock_sttus = true, lock_mode = s.lock_mode,
+                    lease_expiry = current_timestamp() + INTERVAL {LOCK_LEASE_SECONDS} SECONDS
+                WHEN NOT MATCHED THEN INSERT (run_id, lock_path, lock_mode, lock_sttus, creat_date, lease_expiry)
+                VALUES (CAST({RUN_ID} AS BIGINT), s.lock_path, s.lock_mode, true, current_timestamp(),
+                        current_timestamp() + INTERVAL {LOCK_LEASE_SECONDS} SECONDS)
+            """).first()
+        except Exception as e:
+            if not _is_write_conflict(e):
+                raise
+            print(f"Lock grant for run {RUN_ID} lost a write conflict (attempt {attempt + 1})")
+            time.sleep(random.uniform(0, LOCK_POLL_INITIAL))
+            continue
+        if result["num_affected_rows"] > 0:
+            return True, []
+        break
+
+    blocking_run_ids = get_spark().sql(f"SELECT DISTINCT run_id FROM ({blockers}) ORDER BY run_id").collect()
+    return False, [row["run_id"] for row in blocking_run_ids]
+
+def _pg_try_acquire(RUN_ID, lock_paths):
+    paths = [path for path, _ in lock_paths]
+    modes = [mode for _, mode in lock_paths]
+    with postgres_transaction() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PG_LOCK_ADVISORY_KEY,))
+        candidates, candidate_params = _pg_lock_candidates_sql('tbl', paths)
+        cursor.execute(f"""
+            SELECT DISTINCT tbl.run_id
+            FROM unnest(%s::text[], %s::text[]) AS req(lock_path, lock_mode)
+            JOIN {postgres_schema}.tp_run_lock_plc tbl
+            ON {candidates}
+            AND tbl.run_id != %s
+            AND {_lock_conflict_sql('req', 'tbl')}
+            AND (tbl.lease_expiry IS NULL OR tbl.lease_expiry >= clock_timestamp())
+            ORDER BY tbl.run_id
+        """, (paths, modes, *candidate_params, RUN_ID))
+        blocking_run_ids = [row[0] for row in cursor.fetchall()]
+        if not blocking_run_ids:
+            cursor.execute(
+                f"UPDATE {postgres_schema}.tp_run_lock_plc SET lock_sttus = true, lease_expiry = clock_timestamp() + make_interval(secs => %s) "
+                f"WHERE run_id = %s AND lock_path = ANY(%s)",
+                (LOCK_LEASE_SECONDS, RUN_ID, paths)
+            )
+            cursor.execute(
+                f"INSERT INTO {postgres_schema}.tp_run_lock_plc (run_id, lock_path, lock_mode, lock_sttus, creat_date, lease_expiry) "
+                f"SELECT %s, lock_path, lock_mode, true, transaction_timestamp(), transaction_timestamp() + make_interval(secs => %s) "
+                f"FROM unnest(%s::text[], %s::text[]) AS t(lock_path, lock_mode) "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {postgres_schema}.tp_run_lock_plc l WHERE l.run_id = %s AND l.lock_path = t.lock_path)",
+                (RUN_ID, LOCK_LEASE_SECONDS, paths, modes, RUN_ID)
+            )
+    return blocking_run_ids
+
+###############################################################################
+
+def semaphore_acquisition(RUN_ID, PATHS, backend=None, fast_path=False, **lock_options):
     # Acquire semaphore by queuing and checking locks
-    check_path = semaphore_queue(RUN_ID, PATHS)
-    check_path = check_lock(RUN_ID, check_path)
+    # PATHS items are lock paths (exclusive) or (lock_path, "shared" / "exclusive") tuples
+    # lock_options (timeout, max_wait, return_metrics) are passed on to check_lock
+    # backend overrides LOCK_BACKEND; release with the same backend
+    # The locks' lease is renewed by a heartbeat thread until release_semaphore
+    # fast_path first tries try_acquire_semaphore, which grants an uncontended lock in one
+    # statement, and only queues when that fails
+    if fast_path:
+        started = monotonic()
+        attempt = try_acquire_semaphore(RUN_ID, PATHS, backend)
+        if attempt['granted']:
+            check_path = attempt['check_path']
+            start_lock_heartbeat(RUN_ID, check_path, backend)
+            print("Semaphore Acquired by the current process in a single statement")
+            if lock_options.get('return_metrics'):
+                metrics = {'run_id': RUN_ID, 'wait_seconds': round(monotonic() - started, 3), 'checks': 1, 'max_blocked_paths': 0}
+                return check_path, metrics
+            return check_path
+        print(f"Lock on {attempt['check_path']} is held by runs {attempt['blocking_run_ids']}, joining the queue")
+    if (backend or LOCK_BACKEND) == "postgres":
+        queue, check = pg_semaphore_queue, pg_check_lock
+    else:
+        queue, check = semaphore_queue, check_lock
+    check_path = queue(RUN_ID, PATHS)
+    start_lock_heartbeat(RUN_ID, check_path, backend)
+    try:
+        check_path = check(RUN_ID, check_path, **lock_options)
+    except BaseException:
+        stop_lock_heartbeat(RUN_ID, check_path)
+        raise
     return check_path
 
 ################################################################################
 
-def assign_skid(df, run_id, type):
+def _change_feed_start_version(table):
+    # Latest version that turned the change data feed on, or the oldest version in the
+    # history when the table was created with it
+    row = get_spark().sql(f"DESCRIBE HISTORY {table}").selectExpr(
+        """MAX(CASE WHEN operationParameters['properties'] RLIKE '"delta.enableChangeDataFeed"\\\\s*:\\\\s*"true"'
+                    THEN version END) AS enabled""",
+        "MIN(version) AS oldest",
+    ).first()
+    return row["enabled"] if row["enabled"] is not None else row["oldest"]
+
+def maintain_lock_table(catalog_name, retain_hours=LOCK_TABLE_VACUUM_RETAIN_HOURS):
+    """
+    Keeps the Delta lock table small so that lock checks scan a constant amount of data.
+
+    The table only ever holds the locks of live runs, but each queue, grant and release adds
+    files and deletion vectors. This routine, meant for a scheduled job:
+    1. enables the change data feed on the lock table, if needed,
+    2. appends the changes since the last run to tp_run_lock_plc_audit, which keeps the lock
+       history (update preimages are left out) from the version the change data feed was
+       enabled at; the last audited version is kept in the audit table's
+       LOCK_AUDIT_VERSION_PROPERTY, so runs without changes do not lose their place,
+    3. compacts the table with OPTIMIZE ... ZORDER BY (lock_path),
+    4. removes the replaced files with VACUUM.
+    Lock operations running concurrently may hit a Delta write conflict and fail.
+
+    Parameters:
+    catalog_name (str): The catalog holding internal_tp.tp_run_lock_plc.
+    retain_hours (int): Hours of removed files kept by VACUUM.
+
+    Returns:
+    dict: audited_rows, audited_to_version and the file count and size before and after.
+    """
+    table = f"{catalog_name}.internal_tp.tp_run_lock_plc"
+    audit_table = f"{catalog_name}.internal_tp.tp_run_lock_plc_audit"
+
+    before = get_spark().sql(f"DESCRIBE DETAIL {table}").first()
+    cdf_enabled = (before["properties"] or {}).get("delta.enableChangeDataFeed") == "true"
+    if not cdf_enabled:
+        get_spark().sql(f"ALTER TABLE {table} SET TBLPROPERTIES (delta.enableChangeDataFeed = true)")
+    version = get_spark().sql(f"DESCRIBE HISTORY {table} LIMIT 1").first()["version"]
+
+    # Continue after the last audited version; audit tables written before the watermark
+    # property existed fall back to their last commit version
+    start = None
+    audit_exists = get_spark().catalog.tableExists(audit_table)
+    if audit_exists:
+        last = (get_spark().sql(f"DESCRIBE DETAIL {audit_table}").first()["properties"] or {}).get(LOCK_AUDIT_VERSION_PROPERTY)
+        if last is None:
+            last = get_spark().sql(f"SELECT MAX(_commit_version) AS version FROM {audit_table}").first()["version"]
+        if last is not None:
+            start = int(last) + 1
+    if start is None:
+        # The ALTER above is the first version with a change feed
+        start = version if not cdf_enabled else _change_feed_start_version(table)
+
+    audited_rows = 0
+    if start <= version:
+        changes = get_spark().read.format("delta") \
+            .option("readChangeFeed", "true") \
+            .option("startingVersion", start) \
+            .option("endingVersion", version) \
+            .table(table) \
+            .filter("_change_type != 'update_preimage'")
+        audited_rows = changes.count()
+        # The first run creates the audit table even without changes, to hold the watermark
+        if audited_rows or not audit_exists:
+            changes.write.format("delta").mode("append").option("mergeSchema", "true").saveAsTable(audit_table)
+        get_spark().sql(f"ALTER TABLE {audit_table} SET TBLPROPERTIES ('{LOCK_AUDIT_VERSION_PROPERTY}' = '{version}')")
+
+    get_spark().sql(f"OPTIMIZE {table} ZORDER BY (lock_path)")
+    get_spark().sql(f"VACUUM {table} RETAIN {int(retain_hours)} HOURS")
+    after = get_spark().sql(f"DESCRIBE DETAIL {table}").first()
+
+    metrics = {
+        'audited_rows': audited_rows,
+        'audited_to_version': version,
+        'files_before': before["numFiles"],
+        'files_after': after["numFiles"],
+        'bytes_before': before["sizeInBytes"],
+        'bytes_after': after["sizeInBytes"],
+    }
+    print(f"Lock table {table} maintained: {metrics}")
+    return metrics
+
+################################################################################
+
+SKID_KEY_MODES = ('sequence', 'incremental', 'hash')
+# Keeps hash skids non-negative
+SKID_HASH_MASK = 0x7FFFFFFFFFFFFFFF
+# The skid mapping is broadcast to the final join of assign_skid up to this estimated size
+SKID_BROADCAST_MAX_BYTES = 64 * 1024 * 1024
+
+def assign_skid(df, run_id, type, key_mode='sequence', audit=False, cache_input=None):
+    """
+    Assigns {type}_skid to df from the tp_{type}_skid_seq sequence table.
+
+    key_mode:
+    - 'sequence' appends every key of the run to the sequence table and joins the run's
+      skids back, so each run gets new skids.
+    - 'incremental' reuses the lowest skid a key got in any earlier run and only appends
+      the run's unseen keys, once each, so known keys are neither written nor re-read.
+    - 'hash' derives the skid from (srce_sys_id, extrn_{type}_id) with a 63-bit xxhash64,
+      without touching the sequence table. The key is hashed as (BIGINT, STRING), so a
+      skid does not change with the column types of the input, and rows without an
+      external id get a NULL skid; a ValueError is raised if two keys share a skid.
+      Hash skids must not be mixed with sequence skids in the same dimension.
+
+    audit (bool): With key_mode 'hash', record the run's new keys in tp_{type}_skid_hash
+        and extend the collision check to every key recorded there.
+    cache_input: df is read more than once, which reruns its whole lineage each time.
+        "checkpoint" materializes it first with an eager local checkpoint; a StorageLevel
+        (or its name, e.g. "MEMORY_AND_DISK") persists it, in which case the result is
+        locally checkpointed and the input unpersisted before returning. None reads df as is.
+    """
+    persisted = None
     try:
+        if key_mode not in SKID_KEY_MODES:
+            raise ValueError(f"Invalid key_mode {key_mode!r}, expected one of {SKID_KEY_MODES}")
+
         # Convert the type to lowercase for consistency
         type = type.lower()
 
         # Proceed only if the type is either 'prod' or 'mkt'
         if type in ('prod', 'mkt'):
+            # Materialize the input once for the reads below
+            if cache_input == 'checkpoint':
+                df = df.localCheckpoint(eager=True)
+            elif cache_input is not None:
+                level = getattr(StorageLevel, cache_input) if isinstance(cache_input, str) else cache_input
+                df = persisted = df.persist(level)
+
             # Register the input DataFrame as a temporary SQL view
             df.createOrReplaceTempView('input_df')
 
             # Store original column names for later use
             cols = df.columns
 
-            # Select run_id and external ID (based on type) as key
-            df_sel = spark.sql(f"""
-                SELECT CAST(run_id AS BIGINT), extrn_{type}_id AS key 
-                FROM input_df
-            """)
-
-            # Check if the run_id already exists in the target table
-            if spark.sql(f"""
-                SELECT * FROM {catalog_name}.internal_tp.tp_{type}_skid_seq 
-                WHERE run_id = {run_id} 
-                LIMIT 1
-            """).count() == 0:
-                # If not, append the selected data to the target table
-                df_sel.write.mode('append').saveAsTable(f'{catalog_name}.internal_tp.tp_{type}_skid_seq')
-
-            # Read the skid mapping for the given run_id
-            read_query = f"""
-                SELECT {type}_skid, run_id, key 
-                FROM {catalog_name}.internal_tp.tp_{type}_skid_seq 
-                WHERE run_id = {run_id}
-            """
-            df_sel = spark.sql(read_query)
-
-            # Register both input and skid DataFrames as temporary views
-            df.createOrReplaceTempView('input_df')
-            df_sel.createOrReplaceTempView('skid_df')
-
-            # Join input data with skid mapping to assign skid values
-            query = f"""
-                SELECT a.* EXCEPT(a.{type}_skid), b.{type}_skid 
-                FROM input_df a 
-                JOIN skid_df b 
-                ON a.extrn_{type}_id = b.key 
-                AND a.run_id = b.run_id
-            """
-            df = spark.sql(query).select(*cols)
+            if key_mode == 'hash':
+                df = _hash_skid(cols, run_id, type, audit)
+            else:
+                if key_mode == 'incremental':
+                    df_sel = _incremental_skid_map(run_id, type)
+                else:
+                    df_sel = _sequence_skid_map(run_id, type)
+
+                # Pick the join strategy from the estimated size of the skid mapping
+                hint = _skid_join_hint(df_sel)
+
+                # Register the skid DataFrame as a temporary view
+                df_sel.createOrReplaceTempView('skid_df')
+
+                # Join input data with skid mapping to assign skid values
+                query = f"""
+                    SELECT {hint}a.* EXCEPT(a.{type}_skid), b.{type}_skid 
+                    FROM input_df a 
+                    JOIN skid_df b 
+                    ON a.extrn_{type}_id = b.key 
+                    AND a.run_id = b.run_id
+                """
+                df = get_spark().sql(query).select(*cols)
+
+            if persisted is not None:
+                # The result must not read from the input's cache, which is released below
+                df = df.localCheckpoint(eager=True)
 
             return df
 
     except Exception as e:
         # Raise any exceptions encountered during processing
         raise e
+    finally:
+        if persisted is not None:
+            persisted.unpersist()
+
+def _estimated_size_in_bytes(df):
+    # Optimizer estimate of the DataFrame's size, None when the plan cannot be estimated
+    try:
+        return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    except Exception:
+        return None
+
+def _skid_join_hint(df_sel):
+    """
+    Chooses how assign_skid joins the input with the skid mapping (skid_df, alias b).
+    A mapping estimated below SKID_BROADCAST_MAX_BYTES is broadcast; a larger one is
+    shuffle-hash joined, on the exchanges Spark plans for the join keys, so the mapping is
+    not sorted. Without an estimate the choice is left to Spark.
+
+    Returns:
+    str: SQL hint for the join.
+    """
+    size = _estimated_size_in_bytes(df_sel)
+    if size is None:
+        return ""
+    if size <= SKID_BROADCAST_MAX_BYTES:
+        return "/*+ BROADCAST(b) */ "
+    return "/*+ SHUFFLE_HASH(b) */ "
+
+def _hash_skid(cols, run_id, type, audit):
+    # xxhash64 hashes the binary value, so the key is cast to fixed types first
+    srce_sys_id = "CAST(srce_sys_id AS BIGINT)"
+    key = f"CAST(extrn_{type}_id AS STRING)"
+    # xxhash64 skips NULL arguments, so rows without an external id get no skid instead of a shared one
+    skid = f"CASE WHEN extrn_{type}_id IS NULL THEN NULL ELSE xxhash64({srce_sys_id}, {key}) & {SKID_HASH_MASK} END"
+    hash_table = f'{catalog_name}.internal_tp.tp_{type}_skid_hash'
+    audit_exists = audit and get_spark().catalog.tableExists(hash_table)
+
+    # Collision check over the run's distinct keys, plus the recorded ones when auditing
+    keys = f"SELECT DISTINCT {srce_sys_id} AS srce_sys_id, {key} AS key, {skid} AS {type}_skid FROM input_df WHERE extrn_{type}_id IS NOT NULL"
+    if audit_exists:
+        keys = f"{keys} UNION SELECT srce_sys_id, key, {type}_skid FROM {hash_table}"
+    collisions = get_spark().sql(f"""
+        SELECT {type}_skid FROM ({keys})
+        GROUP BY {type}_skid
+        HAVING COUNT(*) > 1
+        LIMIT 10
+    """).collect()
+    if collisions:
+        raise ValueError(f"Hash {type}_skid collision for skids {[row[0] for row in collisions]}")
+
+    if audit:
+        new_keys = f"""
+            SELECT DISTINCT {skid} AS {type}_skid, CAST({run_id} AS BIGINT) AS run_id, {srce_sys_id} AS srce_sys_id, {key} AS key
+            FROM input_df
+            WHERE extrn_{type}_id IS NOT NULL
+        """
+        if audit_exists:
+            new_keys = f"SELECT n.* FROM ({new_keys}) n LEFT ANTI JOIN {hash_table} h ON n.{type}_skid = h.{type}_skid"
+        get_spark().sql(new_keys).write.mode('append').saveAsTable(hash_table)
+
+    return get_spark().sql(f"""
+        SELECT a.* EXCEPT(a.{type}_skid), {skid} AS {type}_skid
+        FROM input_df a
+    """).select(*cols)
+
+def _sequence_skid_map(run_id, type):
+    # Select run_id and external ID (based on type) as key
+    df_sel = get_spark().sql(f"""
+        SELECT CAST(run_id AS BIGINT), extrn_{type}_id AS key 
+        FROM input_df
+    """)
+
+    # Check if the run_id already exists in the target table
+    if get_spark().sql(f"""
+        SELECT * FROM {catalog_name}.internal_tp.tp_{type}_skid_seq 
+        WHERE run_id = {run_id} 
+        LIMIT 1
+    """).count() == 0:
+        # If not, append the selected data to the target table
+        df_sel.write.mode('append').saveAsTable(f'{catalog_name}.internal_tp.tp_{type}_skid_seq')
+
+    # Read the skid mapping for the given run_id
+    read_query = f"""
+        SELECT {type}_skid, run_id, key 
+        FROM {catalog_name}.internal_tp.tp_{type}_skid_seq 
+        WHERE run_id = {run_id}
+    """
+    return get_spark().sql(read_query)
+
+def _incremental_skid_map(run_id, type):
+    seq_table = f'{catalog_name}.internal_tp.tp_{type}_skid_seq'
+    ensure_bloom_filter_index(seq_table, 'key')
+
+    # Append only the keys that never got a skid; on a rerun of the run there are none left
+    new_keys = get_spark().sql(f"""
+        SELECT DISTINCT CAST(a.run_id AS BIGINT) AS run_id, a.extrn_{type}_id AS key
+        FROM input_df a
+        LEFT ANTI JOIN {seq_table} s
+        ON a.extrn_{type}_id = s.key
+    """)
+    new_keys.write.mode('append').saveAsTable(seq_table)
+
+    # Read back the skids of the run's keys only, the lowest one if a key got several
+    return get_spark().sql(f"""
+        SELECT MIN(s.{type}_skid) AS {type}_skid, CAST({run_id} AS BIGINT) AS run_id, s.key
+        FROM {seq_table} s
+        LEFT SEMI JOIN input_df a
+        ON s.key = a.extrn_{type}_id
+        GROUP BY s.key
+    """)
     
 #####################################################################
 
@@ -0,0 +1,31 @@
+import pytest
+import common
+
+# Cached lookups and schemas must not leak between tests that mock the same query
+@pytest.fixture(autouse=True)
+def clear_lookup_cache():
+    common.lookup_cache.invalidate()
+    common.schema_registry.invalidate()
+    yield
+    common.lookup_cache.invalidate()
+    common.schema_registry.invalidate()
+
+# Pooled connections must not leak between tests that mock psycopg2.connect
+@pytest.fixture(autouse=True)
+def reset_postgres_pool():
+    common.close_postgres_pool()
+    yield
+    common.close_postgres_pool()
+
+# Lock heartbeat threads must not outlive the test that started them
+@pytest.fixture(autouse=True)
+def stop_lock_heartbeats():
+    yield
+    for run_id, lock_path in list(common._lock_heartbeats):
+        common.stop_lock_heartbeat(run_id, lock_path)
+
+# Bloom filter index checks are remembered per driver, forget them between tests
+@pytest.fixture(autouse=True)
+def clear_bloom_filter_indexed():
+    common._bloom_filter_indexed.clear()
+    yield
@@ -4,7 +4,7 @@ from common import acn_prod_trans
 
 @pytest.fixture
 def mock_spark():
-    with patch("common.spark") as mock_spark:
+    with patch("common._spark") as mock_spark:
         yield mock_spark
 
 @pytest.fixture
@@ -48,7 +48,8 @@ def mock_dataframes(mock_spark):
 def test_acn_prod_trans_mth(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
     acn_prod_trans(srce_sys_id=1, TIME_PERD_TYPE_CODE="MTH")
     assert mock_dataframes["df_parquet"].withColumn.called
-    assert mock_dataframes["df_parquet"].unionByName.called
+    mock_spark.table.assert_any_call("mock_catalog.gold_tp.tp_prod_dim")
+    assert not mock_dataframes["df_parquet"].unionByName.called
 
 def test_acn_prod_trans_wk(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
     acn_prod_trans(srce_sys_id=2, TIME_PERD_TYPE_CODE="WK")
@@ -64,4 +65,35 @@ def test_acn_prod_trans_edge_case_null_fields(mock_spark, mock_catalog_name, moc
 
 def test_acn_prod_trans_grouping_and_join(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
     acn_prod_trans(srce_sys_id=5, TIME_PERD_TYPE_CODE="WK")
-    assert mock_spark.sql.call_count > 0
\ No newline at end of file
+    assert mock_spark.sql.call_count > 0
+
+def test_acn_prod_trans_single_pass_rollup(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
+    with patch("common.expr") as mock_expr:
+        acn_prod_trans(srce_sys_id=6, TIME_PERD_TYPE_CODE="MTH")
+    mock_dataframes["df_parquet"].repartition.assert_not_called()
+    rollups = [c[0][0] for c in mock_expr.call_args_list]
+    assert "CASE WHEN MIN(pg_brand_txt) = MAX(pg_brand_txt) THEN MIN(pg_brand_txt) END" in rollups
+    assert not any("COUNT(DISTINCT" in r for r in rollups)
+
+def test_acn_prod_trans_returns_result_without_count(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
+    result = acn_prod_trans(srce_sys_id=7, TIME_PERD_TYPE_CODE="MTH")
+    assert result is not None
+    assert "tp_prod_sdim" in mock_spark.sql.call_args[0][0]
+    mock_dataframes["df_parquet"].count.assert_not_called()
+
+def test_acn_prod_trans_observes_raw_row_count(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
+    observation = MagicMock()
+    with patch("common.F") as mock_f:
+        acn_prod_trans(srce_sys_id=8, TIME_PERD_TYPE_CODE="MTH", observation=observation)
+    mock_dataframes["df_parquet"].observe.assert_called_once_with(observation, mock_f.count.return_value.alias.return_value)
+    mock_f.count.return_value.alias.assert_called_once_with("raw_row_count")
+
+def test_acn_prod_trans_anti_joins_sdim_keys(mock_spark, mock_catalog_name, mock_run_id, mock_dataframes):
+    acn_prod_trans(srce_sys_id=9, TIME_PERD_TYPE_CODE="MTH")
+    query = mock_spark.sql.call_args[0][0]
+    assert "LEFT ANTI JOIN" in query
+    assert "SELECT extrn_prod_id, srce_sys_id" in query
+    assert "FROM mock_catalog.internal_tp.tp_prod_sdim" in query
+    assert "WHERE part_srce_sys_id = 9" in query
+    assert "CAST(NULL AS BIGINT) AS prod_skid" in query
+    assert "LEFT OUTER JOIN" not in query
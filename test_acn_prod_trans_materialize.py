@@ -64,4 +64,62 @@ def test_acn_prod_trans_materialize_save_failure():
     run_id = "20250710"
 
     with pytest.raises(Exception, match="Write failed"):
-        acn_prod_trans_materialize(df_mock, run_id)
\ No newline at end of file
+        acn_prod_trans_materialize(df_mock, run_id)
+
+def test_acn_prod_trans_materialize_partitioned():
+    from unittest.mock import patch
+    import json
+    df_mock = MagicMock()
+    rebalanced = df_mock.hint.return_value
+    writer = rebalanced.write.format.return_value.option.return_value.mode.return_value
+    mock_spark = MagicMock()
+    mock_spark.conf.get.return_value = None
+    mock_spark.read.parquet.return_value.inputFiles.return_value = ["f2.zstd.parquet", "f1.zstd.parquet"]
+    mock_dbutils = MagicMock()
+    writer.partitionBy.return_value.save.side_effect = lambda path: mock_spark.conf.set.assert_called_once_with(
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes", str(256 * 1024 * 1024)
+    )
+
+    with patch.dict("common.__dict__", {"_spark": mock_spark, "dbutils": mock_dbutils}):
+        manifest = acn_prod_trans_materialize(df_mock, "20250710", mode="partitioned", partition_by=["pg_categ_txt"])
+
+    expected_path = "/mnt/tp-publish-data/ACN_Prod_Load/20250710/ACN_Prod_Load_chain/tp_mm_ACN_Prod_Load_chain.parquet"
+    df_mock.coalesce.assert_not_called()
+    df_mock.repartition.assert_not_called()
+    df_mock.hint.assert_called_once_with("rebalance", "pg_categ_txt")
+    rebalanced.write.format.return_value.option.assert_called_once_with("compression", "zstd")
+    writer.partitionBy.assert_called_once_with("pg_categ_txt")
+    writer.partitionBy.return_value.save.assert_called_once_with(expected_path)
+    mock_spark.conf.unset.assert_called_once_with("spark.sql.adaptive.advisoryPartitionSizeInBytes")
+    assert manifest["files"] == ["f1.zstd.parquet", "f2.zstd.parquet"]
+    assert manifest["num_files"] == 2
+    assert manifest["target_file_bytes"] == 256 * 1024 * 1024
+    put_path, content, overwrite = mock_dbutils.fs.put.call_args[0]
+    assert put_path == expected_path + "/_manifest.json"
+    assert json.loads(content) == manifest
+    assert overwrite is True
+
+def test_acn_prod_trans_materialize_partitioned_restores_advisory_size():
+    from unittest.mock import patch
+    df_mock = MagicMock()
+    writer = df_mock.hint.return_value.write.format.return_value.option.return_value.mode.return_value
+    writer.save.side_effect = Exception("Write failed")
+    mock_spark = MagicMock()
+    mock_spark.conf.get.return_value = "64MB"
+
+    with patch.dict("common.__dict__", {"_spark": mock_spark, "dbutils": MagicMock()}):
+        with pytest.raises(Exception, match="Write failed"):
+            acn_prod_trans_materialize(df_mock, "20250710", mode="partitioned", codec="snappy", target_file_bytes=1024)
+
+    df_mock.hint.assert_called_once_with("rebalance")
+    df_mock.hint.return_value.write.format.return_value.option.assert_called_once_with("compression", "snappy")
+    writer.partitionBy.assert_not_called()
+    assert [c[0] for c in mock_spark.conf.set.call_args_list] == [
+        ("spark.sql.adaptive.advisoryPartitionSizeInBytes", "1024"),
+        ("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64MB"),
+    ]
+    mock_spark.conf.unset.assert_not_called()
+
+def test_acn_prod_trans_materialize_invalid_mode():
+    with pytest.raises(ValueError, match="Invalid mode"):
+        acn_prod_trans_materialize(MagicMock(), "20250710", mode="bucketed")
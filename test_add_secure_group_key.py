@@ -4,7 +4,9 @@ from pyspark.sql.types import *
 from pyspark.sql.functions import *
 import os
 import common
-from common import add_secure_group_key,spark
+from common import add_secure_group_key,get_spark
+
+spark = get_spark()
 
 # Mock dbutils
 class MockDbutils:
@@ -13,23 +15,16 @@ class MockDbutils:
         def get(scope, key):
             return "mock_schema"
 
-# Mock query result
-class MockQueryResult:
-    def __init__(self, data):
-        self.data = data
-    def collect(self):
-        return self.data
-
 # Inject dbutils
 common.dbutils = MockDbutils()
 
 # Test: Contract-specific key found
-def test_add_secure_group_key_found():
-    def mock_query(query):
+def test_add_secure_group_key_found(monkeypatch):
+    def mock_query(query, collect=False):
         if "mm_cntrt_secur_grp_key_assoc_vw" in query:
-            return MockQueryResult([{"secure_group_key": 54300}])
-        return MockQueryResult([{"secure_group_key": 54200}])
-    common.read_query_from_postgres = mock_query
+            return [{"secure_group_key": 54300}]
+        return [{"secure_group_key": 54200}]
+    monkeypatch.setattr(common, "read_query_from_postgres", mock_query)
 
     df = spark.createDataFrame([("P&G",)], ["product"])
     result_df = common.add_secure_group_key(df, "C123")
@@ -37,12 +32,12 @@ def test_add_secure_group_key_found():
     assert result_df.collect() == expected_df.collect()
 
 # Test: Contract-specific key missing, fallback to default
-def test_add_secure_group_key_default():
-    def mock_query(query):
+def test_add_secure_group_key_default(monkeypatch):
+    def mock_query(query, collect=False):
         if "mm_cntrt_secur_grp_key_assoc_vw" in query:
-            return MockQueryResult([{"secure_group_key": None}])
-        return MockQueryResult([{"secure_group_key": 54200}])
-    common.read_query_from_postgres = mock_query
+            return [{"secure_group_key": None}]
+        return [{"secure_group_key": 54200}]
+    monkeypatch.setattr(common, "read_query_from_postgres", mock_query)
 
     df = spark.createDataFrame([("P&G",)], ["product"])
     result_df = common.add_secure_group_key(df, "C999")
@@ -50,12 +45,12 @@ def test_add_secure_group_key_default():
     assert result_df.collect() == expected_df.collect()
 
 # Test: Empty DataFrame
-def test_add_secure_group_key_empty_df():
-    def mock_query(query):
+def test_add_secure_group_key_empty_df(monkeypatch):
+    def mock_query(query, collect=False):
         if "mm_cntrt_secur_grp_key_assoc_vw" in query:
-            return MockQueryResult([])
-        return MockQueryResult([{"secure_group_key": 54200}])
-    common.read_query_from_postgres = mock_query
+            return []
+        return [{"secure_group_key": 54200}]
+    monkeypatch.setattr(common, "read_query_from_postgres", mock_query)
 
     schema = StructType([StructField("id", StringType(), True)])
     df = spark.createDataFrame([], schema)
@@ -64,15 +59,15 @@ def test_add_secure_group_key_empty_df():
     assert result_df.collect() == expected_df.collect()
 
 # Test: Multiple results, use first
-def test_add_secure_group_key_multiple_results():
-    def mock_query(query):
+def test_add_secure_group_key_multiple_results(monkeypatch):
+    def mock_query(query, collect=False):
         if "mm_cntrt_secur_grp_key_assoc_vw" in query:
-            return MockQueryResult([
+            return [
                 {"secure_group_key": 54300},
                 {"secure_group_key": 60000}
-            ])
-        return MockQueryResult([{"secure_group_key": 54200}])
-    common.read_query_from_postgres = mock_query
+            ]
+        return [{"secure_group_key": 54200}]
+    monkeypatch.setattr(common, "read_query_from_postgres", mock_query)
 
     df = spark.createDataFrame([("P&G",)], ["product"])
     result_df = common.add_secure_group_key(df, "C456")
@@ -80,12 +75,12 @@ def test_add_secure_group_key_multiple_results():
     assert result_df.collect() == expected_df.collect()
 
 # Test: Contract ID is None
-def test_add_secure_group_key_cntrt_id_none():
-    def mock_query(query):
+def test_add_secure_group_key_cntrt_id_none(monkeypatch):
+    def mock_query(query, collect=False):
         if "mm_cntrt_secur_grp_key_assoc_vw" in query:
-            return MockQueryResult([{"secure_group_key": None}])
-        return MockQueryResult([{"secure_group_key": 54200}])
-    common.read_query_from_postgres = mock_query
+            return [{"secure_group_key": None}]
+        return [{"secure_group_key": 54200}]
+    monkeypatch.setattr(common, "read_query_from_postgres", mock_query)
 
     df = spark.createDataFrame([("P&G",)], ["product"])
     result_df = common.add_secure_group_key(df, None)
@@ -0,0 +1,74 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from pyspark.sql import SparkSession
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DateType
+import common
+from common import align_to_schema, SchemaRegistry
+
+@pytest.fixture
+def spark():
+    return SparkSession.builder.getOrCreate()
+
+@pytest.fixture
+def target_schema():
+    return StructType([
+        StructField("prod_skid", LongType()),
+        StructField("UPC_TXT", StringType()),
+        StructField("pg_brand_txt", StringType()),
+        StructField("last_sellg_txt", DateType()),
+    ])
+
+# Test missing columns are added as typed NULLs and existing ones cast, in one projection
+def test_align_to_schema(spark, target_schema):
+    df = spark.createDataFrame([("123", "2024-01-31", "x")], "upc_txt string, last_sellg_txt string, extra_txt string")
+
+    result = align_to_schema(df, target_schema)
+
+    assert result.columns == ["upc_txt", "last_sellg_txt", "extra_txt", "prod_skid", "pg_brand_txt"]
+    assert dict(result.dtypes)["last_sellg_txt"] == "date"
+    assert dict(result.dtypes)["prod_skid"] == "bigint"
+    row = result.collect()[0]
+    assert row["prod_skid"] is None and row["upc_txt"] == "123"
+
+# Test excluded target columns are not added
+def test_align_to_schema_exclude(spark, target_schema):
+    df = spark.createDataFrame([("123",)], "upc_txt string")
+
+    result = align_to_schema(df, target_schema, exclude=("prod_skid", "last_sellg_txt"))
+
+    assert result.columns == ["upc_txt", "pg_brand_txt"]
+
+# Test a DataFrame that already matches is returned unchanged
+def test_align_to_schema_matching(spark, target_schema):
+    df = spark.createDataFrame([], target_schema)
+
+    assert align_to_schema(df, target_schema) is df
+
+# Test existing columns keep their type when casting is turned off
+def test_align_to_schema_without_casts(spark, target_schema):
+    df = spark.createDataFrame([("123", "NOT APPLICABLE")], "upc_txt string, last_sellg_txt string")
+
+    result = align_to_schema(df, target_schema, cast_existing=False)
+
+    assert result.columns == ["upc_txt", "last_sellg_txt", "prod_skid", "pg_brand_txt"]
+    assert dict(result.dtypes)["last_sellg_txt"] == "string"
+    assert result.collect()[0]["last_sellg_txt"] == "NOT APPLICABLE"
+
+# Test the registry reads a schema once and again only after the TTL or an invalidate
+def test_schema_registry_ttl_and_invalidate():
+    mock_spark = MagicMock()
+    clock = iter([0, 0, 700, 700, 710])
+    registry = SchemaRegistry(ttl=600)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}), \
+         patch('common.monotonic', side_effect=lambda: next(clock)):
+        registry.schema("cat.gold_tp.tp_prod_dim")
+        registry.schema("cat.gold_tp.tp_prod_dim")
+        assert mock_spark.table.call_count == 1
+        registry.schema("cat.gold_tp.tp_prod_dim")
+        assert mock_spark.table.call_count == 2
+        registry.invalidate("cat.gold_tp.tp_prod_dim")
+        registry.schema("cat.gold_tp.tp_prod_dim")
+        assert mock_spark.table.call_count == 3
+
+    mock_spark.sql.assert_not_called()
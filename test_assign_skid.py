@@ -37,7 +37,7 @@ def mock_spark():
     return spark
 
 def test_assign_skid_with_valid_prod_type(mock_df, mock_spark):
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         result = assign_skid(mock_df, 123, 'prod')
         assert result.columns == mock_df.columns
 
@@ -51,7 +51,7 @@ def test_assign_skid_with_valid_mkt_type(mock_df, mock_spark):
     mock_sql_result.write.mode.return_value.saveAsTable = MagicMock()
     mock_spark.sql.side_effect = lambda query: mock_sql_result
 
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         result = assign_skid(mock_df, 456, 'mkt')
         assert result.columns == mock_df.columns
 
@@ -72,14 +72,14 @@ def test_assign_skid_skips_insert_if_run_id_exists(mock_df, mock_spark):
         else:
             return MagicMock()
     mock_spark.sql.side_effect = sql_side_effect
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         result = assign_skid(mock_df, 789, 'prod')
         assert result.columns == mock_df.columns
 
 def test_assign_skid_raises_exception_on_spark_error(mock_df):
     mock_spark = MagicMock()
     mock_spark.sql.side_effect = Exception("Spark error")
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         with pytest.raises(Exception, match="Spark error"):
             assign_skid(mock_df, 123, 'prod')
 
@@ -90,7 +90,7 @@ def test_assign_skid_handles_empty_dataframe():
     df.select.return_value = df
     mock_spark = MagicMock()
     mock_spark.sql.return_value = df
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         result = assign_skid(df, 123, 'prod')
         assert result.columns == []
 
@@ -100,12 +100,12 @@ def test_assign_skid_raises_exception_on_missing_column():
     df.createOrReplaceTempView = MagicMock()
     mock_spark = MagicMock()
     mock_spark.sql.side_effect = Exception("Missing column")
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         with pytest.raises(Exception, match="Missing column"):
             assign_skid(df, 123, 'prod')
 
 def test_assign_skid_accepts_case_insensitive_type(mock_df, mock_spark):
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         result = assign_skid(mock_df, 123, 'PrOd')
         assert result.columns == mock_df.columns
 
@@ -119,6 +119,121 @@ def test_assign_skid_preserves_extra_columns(mock_df, mock_spark):
     mock_sql_result.write.mode.return_value.saveAsTable = MagicMock()
     mock_spark.sql.side_effect = lambda query: mock_sql_result
 
-    with patch.dict(assign_skid.__globals__, {'spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
         result = assign_skid(mock_df, 123, 'prod')
-        assert 'extra_col' in result.columns
\ No newline at end of file
+        assert 'extra_col' in result.columns
+
+def test_assign_skid_incremental_appends_only_new_keys(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        result = assign_skid(mock_df, 123, 'prod', key_mode='incremental')
+        assert result.columns == mock_df.columns
+
+    queries = [c[0][0] for c in mock_spark.sql.call_args_list]
+    assert not any("LIMIT 1" in q for q in queries)
+    assert "LEFT ANTI JOIN cdl_tp_dev.internal_tp.tp_prod_skid_seq s" in queries[0]
+    assert "LEFT SEMI JOIN input_df a" in queries[1]
+    assert "MIN(s.prod_skid) AS prod_skid" in queries[1]
+    assert "JOIN skid_df" in queries[2]
+
+def test_assign_skid_invalid_key_mode(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        with pytest.raises(ValueError, match="Invalid key_mode"):
+            assign_skid(mock_df, 123, 'prod', key_mode='random')
+
+
+def _final_join_query(mock_spark):
+    return [c[0][0] for c in mock_spark.sql.call_args_list if "JOIN skid_df" in c[0][0]][0]
+
+def test_assign_skid_broadcasts_small_mapping(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._estimated_size_in_bytes', return_value=1024):
+        assign_skid(mock_df, 123, 'prod')
+
+    assert "/*+ BROADCAST(b) */" in _final_join_query(mock_spark)
+    mock_df.repartition.assert_not_called()
+
+def test_assign_skid_shuffle_hash_joins_large_mapping(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._estimated_size_in_bytes', return_value=64 * 1024 ** 3):
+        result = assign_skid(mock_df, 123, 'prod')
+
+    assert "/*+ SHUFFLE_HASH(b) */" in _final_join_query(mock_spark)
+    mock_df.repartition.assert_not_called()
+    assert result.columns == mock_df.columns
+
+def test_assign_skid_without_size_estimate_adds_no_hint(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._estimated_size_in_bytes', return_value=None):
+        assign_skid(mock_df, 123, 'prod')
+
+    assert "/*+" not in _final_join_query(mock_spark)
+
+
+def test_assign_skid_hash_mode_skips_sequence_table(mock_df, mock_spark):
+    mock_df.columns = ['run_id', 'srce_sys_id', 'extrn_prod_id', 'prod_skid']
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        mock_spark.sql.side_effect = None
+        mock_spark.sql.return_value.collect.return_value = []
+        assign_skid(mock_df, 123, 'prod', key_mode='hash')
+
+    queries = [c[0][0] for c in mock_spark.sql.call_args_list]
+    assert not any("tp_prod_skid_seq" in q for q in queries)
+    assert "HAVING COUNT(*) > 1" in queries[0]
+    assert "xxhash64(CAST(srce_sys_id AS BIGINT), CAST(extrn_prod_id AS STRING))" in queries[0]
+    assert "xxhash64(CAST(srce_sys_id AS BIGINT), CAST(extrn_prod_id AS STRING))" in queries[-1]
+    assert "WHERE extrn_prod_id IS NOT NULL" in queries[0]
+    assert "CASE WHEN extrn_prod_id IS NULL THEN NULL ELSE xxhash64(" in queries[-1]
+    mock_spark.sql.return_value.select.assert_called_once_with(*mock_df.columns)
+    mock_spark.sql.return_value.write.mode.assert_not_called()
+
+def test_assign_skid_hash_mode_raises_on_collision(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        mock_spark.sql.side_effect = None
+        mock_spark.sql.return_value.collect.return_value = [(42,)]
+        with pytest.raises(ValueError, match="collision"):
+            assign_skid(mock_df, 123, 'prod', key_mode='hash')
+
+def test_assign_skid_hash_mode_audit(mock_df, mock_spark):
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        mock_spark.sql.side_effect = None
+        mock_spark.sql.return_value.collect.return_value = []
+        mock_spark.catalog.tableExists.return_value = True
+        assign_skid(mock_df, 123, 'prod', key_mode='hash', audit=True)
+
+    queries = [c[0][0] for c in mock_spark.sql.call_args_list]
+    assert "UNION SELECT srce_sys_id, key, prod_skid FROM cdl_tp_dev.internal_tp.tp_prod_skid_hash" in queries[0]
+    assert "LEFT ANTI JOIN cdl_tp_dev.internal_tp.tp_prod_skid_hash h" in queries[1]
+    assert "CAST(srce_sys_id AS BIGINT) AS srce_sys_id, CAST(extrn_prod_id AS STRING) AS key" in queries[1]
+    assert "WHERE extrn_prod_id IS NOT NULL" in queries[1]
+    mock_spark.sql.return_value.write.mode.return_value.saveAsTable.assert_called_once_with("cdl_tp_dev.internal_tp.tp_prod_skid_hash")
+
+
+def test_assign_skid_checkpoints_input(mock_df, mock_spark):
+    checkpointed = mock_df.localCheckpoint.return_value
+    checkpointed.columns = mock_df.columns
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        assign_skid(mock_df, 123, 'prod', cache_input='checkpoint')
+
+    mock_df.localCheckpoint.assert_called_once_with(eager=True)
+    checkpointed.createOrReplaceTempView.assert_any_call('input_df')
+    mock_df.persist.assert_not_called()
+
+def test_assign_skid_persists_and_releases_input(mock_df, mock_spark):
+    from pyspark import StorageLevel
+    persisted = mock_df.persist.return_value
+    persisted.columns = mock_df.columns
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        result = assign_skid(mock_df, 123, 'prod', cache_input='MEMORY_AND_DISK')
+
+    mock_df.persist.assert_called_once_with(StorageLevel.MEMORY_AND_DISK)
+    persisted.unpersist.assert_called_once()
+    assert result is mock_spark.sql('JOIN skid_df').select.return_value.localCheckpoint.return_value
+
+def test_assign_skid_releases_input_on_error(mock_df):
+    mock_spark = MagicMock()
+    mock_spark.sql.side_effect = Exception("Spark error")
+    with patch.dict(assign_skid.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        with pytest.raises(Exception, match="Spark error"):
+            assign_skid(mock_df, 123, 'prod', cache_input='MEMORY_ONLY')
+
+    mock_df.persist.return_value.unpersist.assert_called_once()
@@ -12,7 +12,7 @@ def test_check_lock_no_lock():
     mock_spark.sql.return_value = mock_df
 
     with patch.dict(check_lock.__globals__, {
-        'spark': mock_spark,
+        '_spark': mock_spark,
         'catalog_name': 'cdl_tp_dev',
         'time': time_module
     }):
@@ -30,10 +30,11 @@ def test_check_lock_with_retry():
     mock_df_unlocked = MagicMock()
     mock_df_unlocked.count.return_value = 0
 
-    mock_spark.sql.side_effect = [mock_df_locked, mock_df_unlocked, mock_df_unlocked]
+    # Lock check, expired lock reclamation, lock check, grant
+    mock_spark.sql.side_effect = [mock_df_locked, MagicMock(), mock_df_unlocked, mock_df_unlocked]
 
     with patch.dict(check_lock.__globals__, {
-        'spark': mock_spark,
+        '_spark': mock_spark,
         'catalog_name': 'cdl_tp_dev',
         'time': time_module
     }), patch.object(time_module, 'sleep', return_value=None):
@@ -47,9 +48,158 @@ def test_check_lock_exception():
     mock_spark.sql.side_effect = Exception("Spark failure")
 
     with patch.dict(check_lock.__globals__, {
-        'spark': mock_spark,
+        '_spark': mock_spark,
         'catalog_name': 'cdl_tp_dev',
         'time': time_module
     }), patch.object(time_module, 'sleep', return_value=None):
         with pytest.raises(Exception, match="Spark failure"):
-            check_lock(RUN_ID=103, check_path="'/path/to/error'")
\ No newline at end of file
+            check_lock(RUN_ID=103, check_path="'/path/to/error'")
+
+# Helper to build a spark mock whose lock check reports the given blocked path counts
+def _spark_with_blockers(counts):
+    mock_spark = MagicMock()
+    results = []
+    for i, count in enumerate(counts):
+        df = MagicMock()
+        df.count.return_value = count
+        results.append(df)
+        if i == 0 and count:
+            # Expired locks are reclaimed the first time the run is blocked
+            results.append(MagicMock())
+    mock_spark.sql.side_effect = results + [MagicMock()] * 5
+    return mock_spark
+
+# Test wait-time metrics are returned on request
+def test_check_lock_returns_metrics():
+    mock_spark = _spark_with_blockers([2, 1, 0])
+
+    with patch.dict(check_lock.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._wait_for_lock_release', return_value=False) as mock_wait:
+        result, metrics = check_lock(RUN_ID=104, check_path="'/a'", return_metrics=True)
+
+    assert result == "'/a'"
+    assert metrics['checks'] == 3
+    assert metrics['max_blocked_paths'] == 2
+    assert mock_wait.call_count == 2
+
+# Test waits grow exponentially and are capped by max_wait
+def test_check_lock_exponential_backoff():
+    mock_spark = _spark_with_blockers([1, 1, 1, 1, 1, 0])
+    waits = []
+
+    def record_wait(seen_seq, wait):
+        waits.append(wait)
+        return False
+
+    with patch.dict(check_lock.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._wait_for_lock_release', side_effect=record_wait), \
+         patch('common.random.uniform', side_effect=lambda low, high: high):
+        check_lock(RUN_ID=105, check_path="'/a'", max_wait=4)
+
+    assert waits == [1, 2, 4, 4, 4]
+
+# Test a release seen while waiting resets the backoff
+def test_check_lock_release_resets_backoff():
+    mock_spark = _spark_with_blockers([1, 1, 1, 0])
+    waits = []
+
+    def record_wait(seen_seq, wait):
+        waits.append(wait)
+        return len(waits) == 2
+
+    with patch.dict(check_lock.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._wait_for_lock_release', side_effect=record_wait), \
+         patch('common.random.uniform', side_effect=lambda low, high: high):
+        check_lock(RUN_ID=106, check_path="'/a'")
+
+    assert waits == [1, 2, 1]
+
+# Test timeout leaves the queue and raises
+def test_check_lock_timeout():
+    mock_spark = MagicMock()
+    mock_df = MagicMock()
+    mock_df.count.return_value = 1
+    mock_spark.sql.return_value = mock_df
+
+    with patch.dict(check_lock.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._wait_for_lock_release', return_value=False), \
+         patch('common.release_semaphore') as mock_release:
+        with pytest.raises(TimeoutError):
+            check_lock(RUN_ID=107, check_path="'/a'", timeout=0)
+
+    mock_release.assert_called_once_with('cdl_tp_dev', 107, "'/a'")
+
+# Test expired locks are reclaimed once when the run is first blocked
+def test_check_lock_reclaims_expired_locks():
+    mock_spark = _spark_with_blockers([1, 1, 0])
+
+    with patch.dict(check_lock.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common._wait_for_lock_release', return_value=False):
+        check_lock(RUN_ID=108, check_path="'/a'")
+
+    statements = [c[0][0].strip() for c in mock_spark.sql.call_args_list]
+    reclaims = [q for q in statements if q.startswith("DELETE")]
+    assert reclaims == ["DELETE FROM cdl_tp_dev.internal_tp.tp_run_lock_plc WHERE lease_expiry < current_timestamp()"]
+    assert statements.index(reclaims[0]) == 1
+    assert "tbl.lease_expiry IS NULL OR tbl.lease_expiry >= current_timestamp()" in statements[0]
+
+# Test which pairs of lock rows conflict, evaluated by Spark SQL
+@pytest.mark.parametrize("curr_path, curr_mode, tbl_path, tbl_mode, conflict", [
+    ("gold_tp/tp_prod_dim", "exclusive", "gold_tp/tp_prod_dim", "exclusive", True),
+    ("gold_tp/tp_prod_dim", "shared", "gold_tp/tp_prod_dim", "shared", False),
+    ("gold_tp/tp_prod_dim", "shared", "gold_tp/tp_prod_dim", "exclusive", True),
+    ("gold_tp/tp_prod_dim", "exclusive", "gold_tp", "exclusive", True),
+    ("gold_tp", "shared", "gold_tp/tp_prod_dim", "exclusive", True),
+    ("gold_tp/tp_prod_dim", "shared", "gold_tp", "shared", False),
+    ("gold_tp/tp_prod_dim", "exclusive", "gold_tp/tp_prod_dim_v2", "exclusive", False),
+    ("gold_tp/tp_prod_dim", "exclusive", "gold_tp/tp_mkt_dim", "exclusive", False),
+    ("gold_tp/tp_prod_dim", "exclusive", "gold_tp/tp_prod_dim", None, True),
+])
+def test_lock_conflict_sql(curr_path, curr_mode, tbl_path, tbl_mode, conflict):
+    from pyspark.sql import SparkSession
+    from common import _lock_conflict_sql
+    spark = SparkSession.builder.getOrCreate()
+    schema = "lock_path string, lock_mode string"
+    spark.createDataFrame([(curr_path, curr_mode)], schema).createOrReplaceTempView("curr_lock")
+    spark.createDataFrame([(tbl_path, tbl_mode)], schema).createOrReplaceTempView("tbl_lock")
+
+    result = spark.sql(f"SELECT {_lock_conflict_sql('curr', 'tbl')} AS conflict FROM curr_lock curr CROSS JOIN tbl_lock tbl").collect()
+
+    assert result[0]["conflict"] is conflict
+
+# Test the PostgreSQL prefilter compares lock_path to constant ancestors and escaped prefixes
+def test_pg_lock_candidates_sql():
+    from common import _pg_lock_candidates_sql
+
+    sql, params = _pg_lock_candidates_sql('tbl', ['gold_tp/tp_prod_dim', 'silver'])
+
+    assert sql == "(tbl.lock_path = ANY(%s) OR tbl.lock_path LIKE %s OR tbl.lock_path LIKE %s)"
+    assert params == [['gold_tp', 'gold_tp/tp_prod_dim', 'silver'], 'gold\\_tp/tp\\_prod\\_dim/%', 'silver/%']
+
+# Test the grant is retried when it loses a Delta write conflict
+def test_check_lock_retries_grant_on_write_conflict():
+    mock_spark = MagicMock()
+    mock_df = MagicMock()
+    mock_df.count.return_value = 0
+    mock_spark.sql.side_effect = [mock_df, Exception("ConcurrentAppendException: Files were added"), MagicMock()]
+
+    with patch.dict(check_lock.__globals__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch.object(time_module, 'sleep', return_value=None):
+        assert check_lock(RUN_ID=110, check_path="'/a'") == "'/a'"
+
+    statements = [c[0][0].strip() for c in mock_spark.sql.call_args_list]
+    assert statements[1].startswith("UPDATE cdl_tp_dev.internal_tp.tp_run_lock_plc")
+    assert statements[2] == statements[1]
+
+# Test waiting runs are only woken up when expired locks were actually reclaimed
+@pytest.mark.parametrize("affected, woken", [(0, False), (2, True)])
+def test_reclaim_expired_locks_wakes_waiters_only_on_reclaim(affected, woken):
+    import common
+    mock_spark = MagicMock()
+    mock_spark.sql.return_value.first.return_value = {"num_affected_rows": affected}
+    seq = common._lock_release_seq
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        assert common.reclaim_expired_locks('cdl_tp_dev') == affected
+
+    assert (common._lock_release_seq != seq) is woken
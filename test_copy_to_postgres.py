@@ -0,0 +1,64 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import common
+from common import copy_to_postgres
+
+# Fixture to inject required global variables
+@pytest.fixture
+def mock_globals():
+    with patch.dict(common.__dict__, {
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }):
+        yield
+
+# Fixture to mock the pooled psycopg2 connection, capturing the COPY payload
+@pytest.fixture
+def mock_conn():
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = conn.cursor.return_value
+    copied = {}
+
+    def copy_expert(sql, stream):
+        copied["sql"] = sql
+        data = []
+        while True:
+            chunk = stream.read(8)
+            if not chunk:
+                break
+            data.append(chunk)
+        copied["data"] = "".join(data)
+
+    cursor.copy_expert.side_effect = copy_expert
+    with patch("common.psycopg2.connect", return_value=conn):
+        yield conn, copied
+
+# Test: Rows are streamed as CSV with NULL markers
+def test_copy_to_postgres_csv(mock_globals, mock_conn):
+    conn, copied = mock_conn
+
+    result = copy_to_postgres("audit_log", [(1, "a,b"), (2, None)], columns=["id", "msg"])
+
+    assert result == 2
+    assert copied["sql"] == "COPY audit_log (id, msg) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    assert copied["data"] == '1,"a,b"\n2,\\N\n'
+    conn.commit.assert_called_once()
+
+# Test: Empty input copies nothing
+def test_copy_to_postgres_empty(mock_globals, mock_conn):
+    conn, copied = mock_conn
+
+    assert copy_to_postgres("audit_log", []) == 0
+    assert copied["sql"] == "COPY audit_log FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    assert copied["data"] == ""
+
+# Test: COPY failure is rolled back
+def test_copy_to_postgres_exception(mock_globals, mock_conn):
+    conn, _ = mock_conn
+    conn.cursor.return_value.copy_expert.side_effect = Exception("COPY failed")
+
+    with pytest.raises(Exception, match="COPY failed"):
+        copy_to_postgres("audit_log", [(1, "a")])
+    conn.rollback.assert_called()
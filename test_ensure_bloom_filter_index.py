@@ -0,0 +1,64 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import common
+from common import ensure_bloom_filter_index
+
+# Helper to build a spark mock whose table has the given (name, metadata) columns
+def _spark_with_columns(columns):
+    mock_spark = MagicMock()
+    fields = []
+    for name, metadata in columns:
+        field = MagicMock()
+        field.name = name
+        field.metadata = metadata
+        fields.append(field)
+    mock_spark.table.return_value.schema.fields = fields
+    return mock_spark
+
+# Test the index is created when the column has none
+def test_ensure_bloom_filter_index_creates_index():
+    mock_spark = _spark_with_columns([("prod_skid", {}), ("extrn_prod_id", {})])
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        created = ensure_bloom_filter_index("cat.internal_tp.tp_prod_sdim", "EXTRN_PROD_ID", fpp=0.05, num_items=1000)
+
+    assert created is True
+    query = " ".join(mock_spark.sql.call_args[0][0].split())
+    assert query == "CREATE BLOOMFILTER INDEX ON TABLE cat.internal_tp.tp_prod_sdim FOR COLUMNS(extrn_prod_id OPTIONS (fpp=0.05, numItems=1000))"
+
+# Test an existing index is detected from the column metadata
+def test_ensure_bloom_filter_index_existing():
+    mock_spark = _spark_with_columns([("extrn_prod_id", {"delta.bloomFilter.enabled": True})])
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        created = ensure_bloom_filter_index("cat.internal_tp.tp_prod_sdim", "extrn_prod_id")
+
+    assert created is False
+    mock_spark.sql.assert_not_called()
+
+# Test the table is only checked once per driver
+def test_ensure_bloom_filter_index_checked_once():
+    mock_spark = _spark_with_columns([("key", {})])
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        ensure_bloom_filter_index("cat.internal_tp.tp_prod_skid_seq", "key")
+        ensure_bloom_filter_index("cat.internal_tp.tp_prod_skid_seq", "key")
+
+    mock_spark.table.assert_called_once()
+    mock_spark.sql.assert_called_once()
+
+# Test a failure to create the index is not raised
+def test_ensure_bloom_filter_index_failure():
+    mock_spark = _spark_with_columns([("extrn_mkt_id", {})])
+    mock_spark.sql.side_effect = Exception("BLOOMFILTER is not supported")
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        assert ensure_bloom_filter_index("cat.internal_tp.tp_mkt_sdim", "extrn_mkt_id") is False
+
+# Test a missing column is reported without creating an index
+def test_ensure_bloom_filter_index_missing_column():
+    mock_spark = _spark_with_columns([("prod_skid", {})])
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        assert ensure_bloom_filter_index("cat.internal_tp.tp_prod_sdim", "extrn_prod_id") is False
+    mock_spark.sql.assert_not_called()
@@ -0,0 +1,115 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import common
+from common import execute_many_to_postgres
+
+# Fixture to inject required global variables
+@pytest.fixture
+def mock_globals():
+    with patch.dict(common.__dict__, {
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }):
+        yield
+
+# Fixture to mock the pooled psycopg2 connection
+@pytest.fixture
+def mock_conn():
+    conn = MagicMock()
+    conn.closed = 0
+    with patch("common.psycopg2.connect", return_value=conn):
+        yield conn, conn.cursor.return_value
+
+# Test: Statement is prepared once and executed in pages
+def test_execute_many_prepared(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+    params = [("DONE", "file1.zip"), ("DONE", "file2.zip")]
+
+    with patch("common.execute_batch") as mock_batch:
+        result = execute_many_to_postgres("UPDATE t SET sttus = %s WHERE file_name = %s", params, page_size=50)
+
+    assert result == 2
+    prepare_sql = cursor.execute.call_args_list[0][0][0]
+    assert prepare_sql.startswith("PREPARE tp_stmt_")
+    assert prepare_sql.endswith("AS UPDATE t SET sttus = $1 WHERE file_name = $2")
+    batch_cursor, batch_sql, batch_params = mock_batch.call_args[0]
+    assert batch_sql.startswith("EXECUTE tp_stmt_") and batch_sql.endswith("(%s, %s)")
+    assert batch_params == params
+    assert mock_batch.call_args[1] == {"page_size": 50}
+    assert cursor.execute.call_args_list[-1][0][0].startswith("DEALLOCATE tp_stmt_")
+    conn.commit.assert_called_once()
+
+# Test: Plain batching without a prepared statement
+def test_execute_many_not_prepared(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+
+    with patch("common.execute_batch") as mock_batch:
+        execute_many_to_postgres("DELETE FROM t WHERE id = %s", [(1,), (2,)], prepared=False)
+
+    mock_batch.assert_called_once_with(cursor, "DELETE FROM t WHERE id = %s", [(1,), (2,)], page_size=1000)
+    cursor.execute.assert_not_called()
+
+# Test: Nothing is sent for an empty parameter list
+def test_execute_many_empty(mock_globals):
+    with patch("common.psycopg2.connect") as mock_connect:
+        assert execute_many_to_postgres("DELETE FROM t WHERE id = %s", []) == 0
+    mock_connect.assert_not_called()
+
+# Test: Failed batch is rolled back
+def test_execute_many_exception(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+
+    with patch("common.execute_batch", side_effect=Exception("Batch failed")):
+        with pytest.raises(Exception, match="Batch failed"):
+            execute_many_to_postgres("DELETE FROM t WHERE id = %s", [(1,)])
+
+    conn.commit.assert_not_called()
+    conn.rollback.assert_called()
+
+# Test: Literal %% is sent as a single % in the prepared statement
+def test_execute_many_prepared_unescapes_percent(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+
+    with patch("common.execute_batch"):
+        execute_many_to_postgres("UPDATE t SET sttus = %s WHERE file_name LIKE 'ACN%%' AND id = %s", [("DONE", 1)])
+
+    prepare_sql = cursor.execute.call_args_list[0][0][0]
+    assert prepare_sql.endswith("AS UPDATE t SET sttus = $1 WHERE file_name LIKE 'ACN%' AND id = $2")
+
+# Test: Prepared statement is deallocated after the failed transaction is rolled back
+def test_execute_many_exception_deallocates(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+    cursor.connection = conn
+    dealloc_cursor = conn.cursor.return_value.__enter__.return_value
+    calls = []
+    conn.rollback.side_effect = lambda: calls.append("rollback")
+    dealloc_cursor.execute.side_effect = lambda sql: calls.append(sql)
+
+    with patch("common.execute_batch", side_effect=Exception("Batch failed")):
+        with pytest.raises(Exception, match="Batch failed"):
+            execute_many_to_postgres("DELETE FROM t WHERE id = %s", [(1,)])
+
+    stmt_name = cursor.execute.call_args_list[0][0][0].split()[1]
+    assert calls[:2] == ["rollback", f"DEALLOCATE {stmt_name}"]
+
+# Test: A placeholder right after an escaped percent is still rewritten
+def test_execute_many_prepared_placeholder_after_percent(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+
+    with patch("common.execute_batch"):
+        execute_many_to_postgres("UPDATE t SET bucket = id %%%s WHERE id = %s", [(8, 1)])
+
+    prepare_sql = cursor.execute.call_args_list[0][0][0]
+    assert prepare_sql.endswith("AS UPDATE t SET bucket = id %$1 WHERE id = $2")
+
+# Test: A placeholder count that does not match the parameters is rejected before connecting
+def test_execute_many_prepared_placeholder_mismatch(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+
+    with patch("common.execute_batch") as mock_batch:
+        with pytest.raises(ValueError, match="2 placeholder"):
+            execute_many_to_postgres("UPDATE t SET sttus = %s WHERE id = %s", [("DONE",)])
+
+    cursor.execute.assert_not_called()
+    mock_batch.assert_not_called()
@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import common
+from common import fetch_query_from_postgres
+
+# Fixture to inject required global variables
+@pytest.fixture
+def mock_globals():
+    with patch.dict(common.__dict__, {
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }):
+        yield
+
+# Fixture to mock a psycopg2 connection with a two-row result
+@pytest.fixture
+def mock_conn():
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = MagicMock()
+    conn.cursor.return_value = cursor
+    cursor.description = [("cntrt_id",), ("file_patrn",)]
+    cursor.fetchall.return_value = [(1, "a_%.csv"), (2, "b_%.csv")]
+    with patch("common.psycopg2.connect", return_value=conn):
+        yield conn, cursor
+
+# Test: Rows are returned as dicts keyed by column name
+def test_fetch_query_rows(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+
+    result = fetch_query_from_postgres("SELECT * FROM t WHERE cntrt_id = %s", (1,))
+
+    cursor.execute.assert_called_once_with("SELECT * FROM t WHERE cntrt_id = %s", (1,))
+    assert result == [{"cntrt_id": 1, "file_patrn": "a_%.csv"}, {"cntrt_id": 2, "file_patrn": "b_%.csv"}]
+    conn.commit.assert_called_once()
+
+# Test: Rows are returned as a pandas DataFrame
+def test_fetch_query_as_pandas(mock_globals, mock_conn):
+    pd = pytest.importorskip("pandas")
+
+    result = fetch_query_from_postgres("SELECT * FROM t", as_pandas=True)
+
+    assert isinstance(result, pd.DataFrame)
+    assert list(result.columns) == ["cntrt_id", "file_patrn"]
+    assert len(result) == 2
+
+# Test: read_query_from_postgres with collect=True skips Spark JDBC
+def test_read_query_collect_uses_driver_path(mock_globals, mock_conn):
+    with patch.object(common, "_spark") as mock_spark:
+        result = common.read_query_from_postgres("SELECT * FROM t", collect=True)
+
+    mock_spark.read.format.assert_not_called()
+    assert len(result) == 2
+
+# Test: Transaction is rolled back when the query fails
+def test_fetch_query_exception(mock_globals, mock_conn):
+    conn, cursor = mock_conn
+    cursor.execute.side_effect = Exception("Query execution failed")
+
+    with pytest.raises(Exception, match="Query execution failed"):
+        fetch_query_from_postgres("SELECT * FROM t")
+    conn.rollback.assert_called()
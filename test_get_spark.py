@@ -0,0 +1,45 @@
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+import common
+from common import get_spark
+
+# Test: Importing common neither creates a SparkSession nor defines a module level spark
+def test_import_is_lazy():
+    import subprocess, sys
+    result = subprocess.run(
+        [sys.executable, "-c", "import common; assert common._spark is None and not hasattr(common, 'spark')"],
+        cwd=os.path.dirname(os.path.abspath(common.__file__)),
+        capture_output=True,
+    )
+    assert result.returncode == 0, result.stderr.decode()
+
+# Test: The notebook's active session is used when there is one
+def test_get_spark_uses_active_session():
+    mock_session = MagicMock()
+    with patch.object(common, "_spark", None), \
+         patch.object(common.SparkSession, "getActiveSession", return_value=mock_session), \
+         patch.object(common.SparkSession, "builder") as mock_builder:
+
+        assert get_spark() is mock_session
+
+        mock_builder.appName.assert_not_called()
+
+# Test: Session is created on first use and reused afterwards
+def test_get_spark_creates_once():
+    mock_session = MagicMock()
+    with patch.object(common, "_spark", None), \
+         patch.object(common.SparkSession, "getActiveSession", return_value=None), \
+         patch.object(common.SparkSession, "builder") as mock_builder:
+        mock_builder.appName.return_value.getOrCreate.return_value = mock_session
+
+        assert get_spark() is mock_session
+        assert get_spark() is mock_session
+
+        mock_builder.appName.assert_called_once_with("Tradepanel")
+
+# Test: A cached session is returned as is
+def test_get_spark_returns_existing_session():
+    mock_session = MagicMock()
+    with patch.object(common, "_spark", mock_session):
+        assert get_spark() is mock_session
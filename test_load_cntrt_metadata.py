@@ -0,0 +1,67 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import common
+from common import load_cntrt_metadata, CntrtMetadata
+
+# Fixture to inject required global variables
+@pytest.fixture
+def mock_globals():
+    with patch.dict(common.__dict__, {
+        "postgres_schema": "mock_schema",
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }):
+        yield
+
+# Fixture to mock a psycopg2 connection returning one result per lookup query
+@pytest.fixture
+def mock_conn():
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = MagicMock()
+    conn.cursor.return_value = cursor
+    cursor.description = [("cntrt_id",), ("dmnsn_name",), ("file_col_name",), ("db_col_name",)]
+    cursor.fetchall.side_effect = [
+        [(123, "prod", "UPC", "upc_txt"), (123, "mkt", "MARKET", "mkt_desc_txt")],
+        [("ACN_%_PROD.csv",)],
+        [("prod", "prod_%.csv", "|"), ("mkt", "mkt_%.csv", None)],
+    ]
+    with patch("common.psycopg2.connect", return_value=conn) as mock_connect:
+        yield conn, cursor, mock_connect
+
+# Test: All lookups are read over a single connection
+def test_load_cntrt_metadata_single_connection(mock_globals, mock_conn):
+    conn, cursor, mock_connect = mock_conn
+
+    result = load_cntrt_metadata(123)
+
+    mock_connect.assert_called_once()
+    assert cursor.execute.call_count == 3
+    conn.commit.assert_called_once()
+    assert isinstance(result, CntrtMetadata)
+    assert result.file_patrn == "ACN_%_PROD.csv"
+    assert result.dmnsn_file_patrn == {"prod": "prod_%.csv", "mkt": "mkt_%.csv"}
+    assert result.dmnsn_dlmtr == {"prod": "|"}
+    assert result.col_assign_for("prod") == [
+        {"cntrt_id": 123, "dmnsn_name": "prod", "file_col_name": "UPC", "db_col_name": "upc_txt"}
+    ]
+
+# Test: Dimension names are passed as a query parameter
+def test_load_cntrt_metadata_dimension_filter(mock_globals, mock_conn):
+    conn, cursor, _ = mock_conn
+
+    load_cntrt_metadata(123, ["prod"])
+
+    query, params = cursor.execute.call_args_list[0][0]
+    assert "dmnsn_name = ANY(%s)" in query
+    assert params == (123, ["prod"])
+
+# Test: Transaction is rolled back when a query fails
+def test_load_cntrt_metadata_exception(mock_globals, mock_conn):
+    conn, cursor, _ = mock_conn
+    cursor.execute.side_effect = Exception("Query failed")
+
+    with pytest.raises(Exception, match="Query failed"):
+        load_cntrt_metadata(123)
+    conn.rollback.assert_called()
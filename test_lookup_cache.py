@@ -0,0 +1,67 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import common
+from common import LookupCache
+
+# Test: Second read of the same query is served from the cache
+def test_lookup_cache_hit():
+    cache = LookupCache()
+    loader = MagicMock(return_value=["row"])
+
+    assert cache.get_or_load("mm_cntrt_lkp", "SELECT 1", loader) == ["row"]
+    assert cache.get_or_load("mm_cntrt_lkp", "SELECT 1", loader) == ["row"]
+
+    loader.assert_called_once()
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+# Test: Parameters are part of the cache key
+def test_lookup_cache_params_in_key():
+    cache = LookupCache()
+    loader = MagicMock(side_effect=["a", "b"])
+
+    assert cache.get_or_load("mm_cntrt_lkp", "SELECT 1", loader, params=(1,)) == "a"
+    assert cache.get_or_load("mm_cntrt_lkp", "SELECT 1", loader, params=(2,)) == "b"
+    assert loader.call_count == 2
+
+# Test: Entries expire after the TTL of their table
+def test_lookup_cache_ttl_expiry():
+    cache = LookupCache(ttl={"mm_cntrt_lkp": 10})
+    loader = MagicMock(side_effect=["old", "new"])
+
+    with patch("common.monotonic", return_value=100):
+        cache.get_or_load("mm_cntrt_lkp", "SELECT 1", loader)
+    with patch("common.monotonic", return_value=111):
+        assert cache.get_or_load("mm_cntrt_lkp", "SELECT 1", loader) == "new"
+
+# Test: Least recently used entry is evicted when the cache is full
+def test_lookup_cache_lru_eviction():
+    cache = LookupCache(maxsize=2)
+    cache.get_or_load("t", "q1", lambda: 1)
+    cache.get_or_load("t", "q2", lambda: 2)
+    cache.get_or_load("t", "q1", lambda: 1)
+    cache.get_or_load("t", "q3", lambda: 3)
+
+    loader = MagicMock(return_value=2)
+    cache.get_or_load("t", "q2", loader)
+    loader.assert_called_once()
+
+# Test: Invalidating a table only evicts lookups that read it
+def test_lookup_cache_invalidate_table():
+    cache = LookupCache()
+    cache.get_or_load(("mm_cntrt_file_lkp", "mm_col_dlmtr_lkp"), "q1", lambda: 1)
+    cache.get_or_load("mm_cntrt_lkp", "q2", lambda: 2)
+
+    cache.invalidate("mm_col_dlmtr_lkp")
+
+    assert cache.stats()["size"] == 1
+    loader = MagicMock(return_value=1)
+    cache.get_or_load("mm_cntrt_file_lkp", "q1", loader)
+    loader.assert_called_once()
+
+# Test: load_cntrt_lkp reads PostgreSQL once for repeated calls
+def test_load_cntrt_lkp_uses_cache():
+    mock_read = MagicMock(return_value="df")
+    with patch.dict(common.__dict__, {"postgres_schema": "mock_schema", "read_query_from_postgres": mock_read}):
+        assert common.load_cntrt_lkp(123) == "df"
+        assert common.load_cntrt_lkp(123) == "df"
+    mock_read.assert_called_once()
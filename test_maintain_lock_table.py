@@ -0,0 +1,115 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import common
+from common import maintain_lock_table
+
+AUDIT_TABLE = "cdl_tp_dev.internal_tp.tp_run_lock_plc_audit"
+
+# Helper to build a spark mock answering the maintenance queries
+def _spark_mock(cdf_enabled, audit_exists, last_version, version=12, changes=3, watermark=None, cdf_enabled_at=None):
+    mock_spark = MagicMock()
+
+    def sql(query):
+        df = MagicMock()
+        if query == f"DESCRIBE DETAIL {AUDIT_TABLE}":
+            properties = {"tp.audit.lastVersion": str(watermark)} if watermark is not None else {}
+            df.first.return_value = {"properties": properties}
+        elif query.startswith("DESCRIBE DETAIL"):
+            properties = {"delta.enableChangeDataFeed": "true"} if cdf_enabled else {}
+            df.first.return_value = {"properties": properties, "numFiles": 40, "sizeInBytes": 4000}
+        elif query.startswith("DESCRIBE HISTORY"):
+            df.first.return_value = {"version": version}
+            df.selectExpr.return_value.first.return_value = {"enabled": cdf_enabled_at, "oldest": 0}
+        elif query.startswith("SELECT MAX(_commit_version)"):
+            df.first.return_value = {"version": last_version}
+        return df
+
+    mock_spark.sql.side_effect = sql
+    mock_spark.catalog.tableExists.return_value = audit_exists
+    reader = mock_spark.read.format.return_value
+    reader.option.return_value = reader
+    changes_df = reader.table.return_value.filter.return_value
+    changes_df.count.return_value = changes
+    return mock_spark, reader, changes_df
+
+def _save_as_table(changes_df):
+    return changes_df.write.format.return_value.mode.return_value.option.return_value.saveAsTable
+
+# Test changes since the last audited version are appended and the table is compacted
+def test_maintain_lock_table_audits_and_compacts():
+    mock_spark, reader, changes_df = _spark_mock(cdf_enabled=True, audit_exists=True, last_version=None, watermark=9)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        metrics = maintain_lock_table('cdl_tp_dev')
+
+    statements = [c[0][0] for c in mock_spark.sql.call_args_list]
+    assert not any(q.startswith("ALTER TABLE cdl_tp_dev.internal_tp.tp_run_lock_plc ") for q in statements)
+    assert not any(q.startswith("SELECT MAX(_commit_version)") for q in statements)
+    reader.option.assert_any_call("startingVersion", 10)
+    reader.option.assert_any_call("endingVersion", 12)
+    reader.table.assert_called_once_with("cdl_tp_dev.internal_tp.tp_run_lock_plc")
+    _save_as_table(changes_df).assert_called_once_with(AUDIT_TABLE)
+    assert f"ALTER TABLE {AUDIT_TABLE} SET TBLPROPERTIES ('tp.audit.lastVersion' = '12')" in statements
+    assert "OPTIMIZE cdl_tp_dev.internal_tp.tp_run_lock_plc ZORDER BY (lock_path)" in statements
+    assert "VACUUM cdl_tp_dev.internal_tp.tp_run_lock_plc RETAIN 168 HOURS" in statements
+    assert metrics['audited_rows'] == 3
+    assert metrics['audited_to_version'] == 12
+
+# Test a run without changes still moves the watermark
+def test_maintain_lock_table_no_changes_keeps_watermark():
+    mock_spark, reader, changes_df = _spark_mock(cdf_enabled=True, audit_exists=True, last_version=None, watermark=9, changes=0)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        metrics = maintain_lock_table('cdl_tp_dev')
+
+    statements = [c[0][0] for c in mock_spark.sql.call_args_list]
+    _save_as_table(changes_df).assert_not_called()
+    assert f"ALTER TABLE {AUDIT_TABLE} SET TBLPROPERTIES ('tp.audit.lastVersion' = '12')" in statements
+    assert metrics['audited_rows'] == 0
+
+# Test the first run enables the change data feed and audits from that version on
+def test_maintain_lock_table_first_run():
+    mock_spark, reader, changes_df = _spark_mock(cdf_enabled=False, audit_exists=False, last_version=None, changes=0)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        metrics = maintain_lock_table('cdl_tp_dev', retain_hours=24)
+
+    statements = [c[0][0] for c in mock_spark.sql.call_args_list]
+    assert "ALTER TABLE cdl_tp_dev.internal_tp.tp_run_lock_plc SET TBLPROPERTIES (delta.enableChangeDataFeed = true)" in statements
+    reader.option.assert_any_call("startingVersion", 12)
+    _save_as_table(changes_df).assert_called_once()
+    assert f"ALTER TABLE {AUDIT_TABLE} SET TBLPROPERTIES ('tp.audit.lastVersion' = '12')" in statements
+    assert "VACUUM cdl_tp_dev.internal_tp.tp_run_lock_plc RETAIN 24 HOURS" in statements
+    assert metrics['audited_rows'] == 0
+
+# Test without a watermark the audit starts where the change data feed was enabled
+@pytest.mark.parametrize("audit_exists", [True, False])
+def test_maintain_lock_table_starts_at_cdf_version(audit_exists):
+    mock_spark, reader, changes_df = _spark_mock(cdf_enabled=True, audit_exists=audit_exists, last_version=None, cdf_enabled_at=5)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        maintain_lock_table('cdl_tp_dev')
+
+    reader.option.assert_any_call("startingVersion", 5)
+    reader.option.assert_any_call("endingVersion", 12)
+
+# Test audit tables without the watermark continue after their last commit version
+def test_maintain_lock_table_legacy_audit_table():
+    mock_spark, reader, changes_df = _spark_mock(cdf_enabled=True, audit_exists=True, last_version=9)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        maintain_lock_table('cdl_tp_dev')
+
+    reader.option.assert_any_call("startingVersion", 10)
+
+# Test nothing is read from the change feed when the audit table is up to date
+def test_maintain_lock_table_nothing_to_audit():
+    mock_spark, reader, changes_df = _spark_mock(cdf_enabled=True, audit_exists=True, last_version=None, watermark=12)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark}):
+        metrics = maintain_lock_table('cdl_tp_dev')
+
+    statements = [c[0][0] for c in mock_spark.sql.call_args_list]
+    reader.table.assert_not_called()
+    assert not any(q.startswith(f"ALTER TABLE {AUDIT_TABLE}") for q in statements)
+    assert metrics['audited_rows'] == 0
@@ -7,7 +7,7 @@ from common import read_from_postgres
 # Fixture to mock the SparkSession used in the function
 @pytest.fixture
 def mock_spark():
-    with patch.object(common, "spark") as mock_spark:
+    with patch.object(common, "_spark") as mock_spark:
         yield mock_spark
 
 # Fixture to inject required global variables into the common module
@@ -56,4 +56,43 @@ def test_read_from_postgres_exception(mock_spark, mock_globals):
     mock_spark.read.format.return_value = mock_reader
 
     with pytest.raises(Exception, match="Connection failed"):
-        read_from_postgres("my_table")
\ No newline at end of file
+        read_from_postgres("my_table")
+
+# Test case: Partitioned read with explicit bounds
+def test_read_from_postgres_partitioned(mock_spark, mock_globals):
+    mock_reader = MagicMock()
+    mock_reader.option.return_value = mock_reader
+    mock_spark.read.format.return_value = mock_reader
+
+    read_from_postgres("my_table", partition_column="id", lower_bound=1, upper_bound=1000, num_partitions=8, fetchsize=10000)
+
+    mock_reader.option.assert_any_call("partitionColumn", "id")
+    mock_reader.option.assert_any_call("lowerBound", "1")
+    mock_reader.option.assert_any_call("upperBound", "1000")
+    mock_reader.option.assert_any_call("numPartitions", 8)
+    mock_reader.option.assert_any_call("fetchsize", 10000)
+
+# Test case: Missing bounds are discovered with MIN/MAX on the filtered table
+def test_read_from_postgres_discovers_bounds(mock_spark, mock_globals):
+    mock_reader = MagicMock()
+    mock_reader.option.return_value = mock_reader
+    mock_spark.read.format.return_value = mock_reader
+
+    with patch("common.fetch_query_from_postgres", return_value=[{"lower_bound": 5, "upper_bound": 50}]) as mock_fetch:
+        read_from_postgres("my_table", partition_column="id", num_partitions=4, where="srce_sys_id = 3")
+
+    mock_fetch.assert_called_once_with("SELECT MIN(id) AS lower_bound, MAX(id) AS upper_bound FROM my_table WHERE srce_sys_id = 3")
+    mock_reader.option.assert_any_call("dbtable", "(SELECT * FROM my_table WHERE srce_sys_id = 3) AS src")
+    mock_reader.option.assert_any_call("lowerBound", "5")
+    mock_reader.option.assert_any_call("upperBound", "50")
+
+# Test case: Empty table is read without partitioning options
+def test_read_from_postgres_partitioned_empty_table(mock_spark, mock_globals):
+    mock_reader = MagicMock()
+    mock_reader.option.return_value = mock_reader
+    mock_spark.read.format.return_value = mock_reader
+
+    with patch("common.fetch_query_from_postgres", return_value=[{"lower_bound": None, "upper_bound": None}]):
+        read_from_postgres("my_table", partition_column="id")
+
+    assert mock_reader.option.call_count == 8
@@ -7,7 +7,7 @@ from common import read_query_from_postgres
 # Fixture to mock SparkSession
 @pytest.fixture
 def mock_spark():
-    with patch.object(common, "spark") as mock_spark:
+    with patch.object(common, "_spark") as mock_spark:
         yield mock_spark
 
 # Fixture to inject required global variables
@@ -4,7 +4,7 @@ import common
 
 def setup_module(module):
     """Set up global spark mock."""
-    setattr(common, 'spark', MagicMock())
+    setattr(common, '_spark', MagicMock())
 
 def test_release_semaphore_query_format_single_path():
     catalog_name = 'test_catalog'
@@ -17,7 +17,7 @@ def test_release_semaphore_query_format_single_path():
     )
 
     common.release_semaphore(catalog_name, run_id, lock_path)
-    actual_query = common.spark.sql.call_args[0][0].strip()
+    actual_query = common._spark.sql.call_args[0][0].strip()
     assert actual_query == expected_query
 
 def test_release_semaphore_query_format_multiple_paths():
@@ -31,7 +31,7 @@ def test_release_semaphore_query_format_multiple_paths():
     )
 
     common.release_semaphore(catalog_name, run_id, lock_path)
-    actual_query = common.spark.sql.call_args[0][0].strip()
+    actual_query = common._spark.sql.call_args[0][0].strip()
     assert actual_query == expected_query
 
 def test_release_semaphore_sql_error():
@@ -40,7 +40,34 @@ def test_release_semaphore_sql_error():
     lock_path = "'/tmp/lock1'"
 
     mock_func = MagicMock(side_effect=Exception("SQL execution failed"))
-    setattr(common, 'spark', MagicMock(sql=mock_func))
+    setattr(common, '_spark', MagicMock(sql=mock_func))
 
     with pytest.raises(Exception, match="SQL execution failed"):
-        common.release_semaphore(catalog_name, run_id, lock_path)
\ No newline at end of file
+        common.release_semaphore(catalog_name, run_id, lock_path)
+
+def test_release_semaphore_retries_write_conflict():
+    from unittest.mock import patch
+    mock_func = MagicMock(side_effect=[Exception("ConcurrentDeleteReadException"), MagicMock()])
+    setattr(common, '_spark', MagicMock(sql=mock_func))
+
+    with patch("common.time.sleep"):
+        common.release_semaphore('test_catalog', 404, "'/tmp/lock1'")
+
+    assert mock_func.call_count == 2
+
+def test_release_semaphore_postgres_backend():
+    from unittest.mock import patch
+    conn = MagicMock()
+    conn.closed = 0
+    with patch.dict(common.__dict__, {
+        "postgres_schema": "mock_schema",
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }), patch("common.psycopg2.connect", return_value=conn):
+        common.release_semaphore(None, 404, "'/tmp/lock1'", backend="postgres")
+
+    conn.cursor.return_value.execute.assert_called_once_with(
+        "DELETE FROM mock_schema.tp_run_lock_plc WHERE run_id = %s AND lock_path IN ('/tmp/lock1')", (404,)
+    )
+    conn.commit.assert_called_once()
@@ -1,5 +1,6 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+import common
 from common import semaphore_acquisition
 
 # Mock implementations
@@ -55,4 +56,82 @@ def test_check_lock_returns_none(mock_lock, mock_queue):
     run_id = "RUN005"
     paths = ["pathZ"]
     result = semaphore_acquisition(run_id, paths)
-    assert result is None
\ No newline at end of file
+    assert result is None
+
+# Fixture to mock the pooled psycopg2 connection used by the postgres lock backend
+@pytest.fixture
+def pg_cursor():
+    import common
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = conn.cursor.return_value
+    with patch.dict(common.__dict__, {
+        "postgres_schema": "mock_schema",
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }), patch("common.psycopg2.connect", return_value=conn):
+        yield cursor
+
+# Test case: postgres backend queues, checks under the advisory lock and grants
+def test_semaphore_acquisition_postgres_backend(pg_cursor):
+    pg_cursor.fetchone.return_value = (0,)
+
+    result = semaphore_acquisition(7, ["gold_tp/tp_prod_dim"], backend="postgres")
+
+    assert result == "'gold_tp/tp_prod_dim'"
+    statements = [c[0][0].strip() for c in pg_cursor.execute.call_args_list]
+    assert statements[0].startswith("INSERT INTO mock_schema.tp_run_lock_plc")
+    assert pg_cursor.execute.call_args_list[0][0][1] == (7, common.LOCK_LEASE_SECONDS, ["gold_tp/tp_prod_dim"], ["exclusive"])
+    assert statements[1] == "SELECT pg_advisory_xact_lock(%s)"
+    assert statements[2].startswith("SELECT COUNT(DISTINCT curr.lock_path)")
+    assert statements[3].startswith("UPDATE mock_schema.tp_run_lock_plc SET lock_sttus = true")
+
+# Test case: postgres backend waits while another run is ahead in the queue
+def test_semaphore_acquisition_postgres_backend_waits(pg_cursor):
+    pg_cursor.fetchone.side_effect = [(1,), (0,)]
+
+    with patch('common._wait_for_lock_release', return_value=False) as mock_wait:
+        result = semaphore_acquisition(8, ["gold_tp/tp_prod_dim"], backend="postgres")
+
+    assert result == "'gold_tp/tp_prod_dim'"
+    mock_wait.assert_called_once()
+
+# Test case: a heartbeat is started for the queued paths
+@patch('common.semaphore_queue', side_effect=lambda run_id, paths: "'pathA'")
+@patch('common.check_lock', side_effect=lambda run_id, paths: paths)
+def test_semaphore_acquisition_starts_heartbeat(mock_lock, mock_queue):
+    with patch('common.start_lock_heartbeat') as mock_start:
+        semaphore_acquisition("RUN006", ["pathA"])
+    mock_start.assert_called_once_with("RUN006", "'pathA'", None)
+
+# Test case: the heartbeat is stopped when the lock cannot be acquired
+@patch('common.semaphore_queue', side_effect=lambda run_id, paths: "'pathA'")
+@patch('common.check_lock', side_effect=TimeoutError("timed out"))
+def test_semaphore_acquisition_stops_heartbeat_on_failure(mock_lock, mock_queue):
+    with patch('common.start_lock_heartbeat'), patch('common.stop_lock_heartbeat') as mock_stop:
+        with pytest.raises(TimeoutError):
+            semaphore_acquisition("RUN007", ["pathA"])
+    mock_stop.assert_called_once_with("RUN007", "'pathA'")
+
+# Test case: fast path grants an uncontended lock without queuing
+@patch('common.semaphore_queue')
+@patch('common.check_lock')
+def test_semaphore_acquisition_fast_path(mock_lock, mock_queue):
+    attempt = {'granted': True, 'blocking_run_ids': [], 'check_path': "'pathA'"}
+    with patch('common.try_acquire_semaphore', return_value=attempt), patch('common.start_lock_heartbeat') as mock_start:
+        result = semaphore_acquisition("RUN008", ["pathA"], fast_path=True)
+    assert result == "'pathA'"
+    mock_queue.assert_not_called()
+    mock_lock.assert_not_called()
+    mock_start.assert_called_once_with("RUN008", "'pathA'", None)
+
+# Test case: fast path falls back to the queue when the lock is held
+@patch('common.semaphore_queue', side_effect=lambda run_id, paths: "'pathA'")
+@patch('common.check_lock', side_effect=lambda run_id, paths: paths)
+def test_semaphore_acquisition_fast_path_contended(mock_lock, mock_queue):
+    attempt = {'granted': False, 'blocking_run_ids': [5], 'check_path': "'pathA'"}
+    with patch('common.try_acquire_semaphore', return_value=attempt), patch('common.start_lock_heartbeat'):
+        result = semaphore_acquisition("RUN009", ["pathA"], fast_path=True)
+    assert result == "'pathA'"
+    mock_queue.assert_called_once_with("RUN009", ["pathA"])
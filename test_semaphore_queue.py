@@ -1,14 +1,14 @@
 import pytest
 from unittest.mock import MagicMock
 from pyspark.sql import Row
-from common import semaphore_queue
+from common import semaphore_queue, pg_semaphore_queue
 
 # Define a global RUN_ID so it can be referenced inside the mock_lit function
 RUN_ID = 123
 
 # Pytest fixture to set up all necessary mocks before each test
 @pytest.fixture
-def setup_mocks():
+def setup_mocks(monkeypatch):
     # Mock for lit(RUN_ID).cast("bigint")
     mock_lit_run_id = MagicMock()
     mock_lit_run_id.cast.return_value = "casted_run_id"
@@ -33,7 +33,7 @@ def setup_mocks():
     mock_df.withColumn.side_effect = lambda col, val: mock_df  # Chainable
     mock_df.createOrReplaceTempView.return_value = None
 
-    # Mock the write operation chain: write.format().mode().saveAsTable()
+    # Mock the write operation chain: write.format().mode().option().saveAsTable()
     mock_write = MagicMock()
     mock_format = MagicMock()
     mock_mode = MagicMock()
@@ -41,6 +41,7 @@ def setup_mocks():
     mock_df.write = mock_write
     mock_write.format.return_value = mock_format
     mock_format.mode.return_value = mock_mode
+    mock_mode.option.return_value = mock_mode
     mock_mode.saveAsTable.return_value = None
 
     # Mock SparkSession and its createDataFrame method
@@ -49,10 +50,12 @@ def setup_mocks():
 
     # Inject mocks into the semaphore_queue function's module
     import common
-    common.spark = mock_spark
+    common._spark = mock_spark
     common.lit = mock_lit
     common.current_timestamp = mock_current_timestamp
     common.catalog_name = "cdl_tp_dev"
+    mock_expr = MagicMock(side_effect=lambda sql: f"expr({sql})")
+    monkeypatch.setattr(common, "expr", mock_expr)
 
     # Return all mocks for use in assertions
     return {
@@ -73,7 +76,7 @@ def test_multiple_paths(setup_mocks):
     result = semaphore_queue(RUN_ID, paths)
 
     setup_mocks["mock_spark"].createDataFrame.assert_called_once_with(
-        [Row(lock_path='path1'), Row(lock_path='path2'), Row(lock_path='path3')]
+        [Row(lock_path='path1', lock_mode='exclusive'), Row(lock_path='path2', lock_mode='exclusive'), Row(lock_path='path3', lock_mode='exclusive')]
     )
     assert result == expected_check_path
 
@@ -85,7 +88,7 @@ def test_single_path(setup_mocks):
     result = semaphore_queue(RUN_ID, paths)
 
     setup_mocks["mock_spark"].createDataFrame.assert_called_once_with(
-        [Row(lock_path='single_path')]
+        [Row(lock_path='single_path', lock_mode='exclusive')]
     )
     assert result == expected_check_path
 
@@ -109,6 +112,7 @@ def test_column_additions(setup_mocks):
     mock_df.withColumn.assert_any_call("run_id", "casted_run_id")
     mock_df.withColumn.assert_any_call("lock_sttus", setup_mocks["mock_lit_false"])
     mock_df.withColumn.assert_any_call("creat_date", "current_timestamp()")
+    mock_df.withColumn.assert_any_call("lease_expiry", "expr(current_timestamp() + INTERVAL 300 SECONDS)")
 
 # Test case: verify write operations to the table
 def test_table_write_operations(setup_mocks):
@@ -118,4 +122,51 @@ def test_table_write_operations(setup_mocks):
 
     setup_mocks["mock_write"].format.assert_called_once_with("delta")
     setup_mocks["mock_format"].mode.assert_called_once_with("append")
-    setup_mocks["mock_mode"].saveAsTable.assert_called_once_with("cdl_tp_dev.internal_tp.tp_run_lock_plc")
\ No newline at end of file
+    setup_mocks["mock_mode"].option.assert_called_once_with("mergeSchema", "true")
+    setup_mocks["mock_mode"].saveAsTable.assert_called_once_with("cdl_tp_dev.internal_tp.tp_run_lock_plc")
+
+# Test case: shared and exclusive lock modes
+def test_lock_modes(setup_mocks):
+    paths = [("gold_tp/tp_prod_dim", "shared"), "gold_tp/tp_mkt_dim"]
+
+    result = semaphore_queue(RUN_ID, paths)
+
+    setup_mocks["mock_spark"].createDataFrame.assert_called_once_with(
+        [Row(lock_path='gold_tp/tp_prod_dim', lock_mode='shared'), Row(lock_path='gold_tp/tp_mkt_dim', lock_mode='exclusive')]
+    )
+    assert result == "'gold_tp/tp_prod_dim', 'gold_tp/tp_mkt_dim'"
+
+# Test case: trailing slashes are dropped before the paths are stored
+def test_trailing_slash(setup_mocks):
+    result = semaphore_queue(RUN_ID, ["gold_tp/", ("gold_tp/tp_prod_dim//", "shared")])
+
+    setup_mocks["mock_spark"].createDataFrame.assert_called_once_with(
+        [Row(lock_path='gold_tp', lock_mode='exclusive'), Row(lock_path='gold_tp/tp_prod_dim', lock_mode='shared')]
+    )
+    assert result == "'gold_tp', 'gold_tp/tp_prod_dim'"
+
+# Test case: unknown lock mode is rejected
+def test_invalid_lock_mode(setup_mocks):
+    with pytest.raises(ValueError, match="Invalid lock mode"):
+        semaphore_queue(RUN_ID, [("gold_tp/tp_prod_dim", "read")])
+
+# Test case: the postgres queue gives all rows of the run one transaction timestamp
+def test_pg_semaphore_queue_shares_creat_date():
+    from unittest.mock import patch
+    import common
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = conn.cursor.return_value
+    with patch.dict(common.__dict__, {
+        "postgres_schema": "mock_schema",
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }), patch("common.psycopg2.connect", return_value=conn):
+        result = pg_semaphore_queue(RUN_ID, ["gold_tp/tp_prod_dim", "gold_tp/tp_mkt_dim"])
+
+    query, params = cursor.execute.call_args[0]
+    assert "false, transaction_timestamp(), transaction_timestamp() + make_interval" in query
+    assert "clock_timestamp()" not in query
+    assert params[2] == ["gold_tp/tp_prod_dim", "gold_tp/tp_mkt_dim"]
+    assert result == "'gold_tp/tp_prod_dim', 'gold_tp/tp_mkt_dim'"
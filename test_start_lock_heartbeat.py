@@ -0,0 +1,78 @@
+import pytest
+import threading
+from unittest.mock import MagicMock, patch
+import common
+from common import start_lock_heartbeat, stop_lock_heartbeat
+
+# Test the heartbeat renews the lease until it is stopped
+def test_start_lock_heartbeat_renews_lease():
+    renewed = threading.Event()
+
+    with patch('common.renew_lock_lease', side_effect=lambda *args: renewed.set()) as mock_renew:
+        thread = start_lock_heartbeat(101, "'/a'", lease_seconds=0.03)
+        assert renewed.wait(2)
+        stop_lock_heartbeat(101, "'/a'")
+        thread.join(2)
+
+    assert not thread.is_alive()
+    mock_renew.assert_called_with(101, "'/a'", None, 0.03)
+
+# Test a failed renewal does not stop the heartbeat
+def test_start_lock_heartbeat_survives_failure():
+    calls = []
+    done = threading.Event()
+
+    def renew(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise Exception("Delta conflict")
+        done.set()
+
+    with patch('common.renew_lock_lease', side_effect=renew):
+        thread = start_lock_heartbeat(102, "'/a'", lease_seconds=0.03)
+        assert done.wait(2)
+        stop_lock_heartbeat(102, "'/a'")
+        thread.join(2)
+
+    assert len(calls) >= 2
+
+# Test the heartbeat stops with an error after repeated renewal failures
+def test_start_lock_heartbeat_raises_after_repeated_failures():
+    errors = []
+
+    with patch('common.renew_lock_lease', side_effect=Exception("Delta conflict")) as mock_renew, \
+         patch('threading.excepthook', side_effect=lambda args: errors.append(args.exc_value)):
+        thread = start_lock_heartbeat(105, "'/a'", lease_seconds=0.03)
+        thread.join(2)
+
+    assert not thread.is_alive()
+    assert mock_renew.call_count == common.LOCK_HEARTBEAT_MAX_FAILURES
+    assert isinstance(errors[0], RuntimeError)
+
+# Test release_semaphore stops the heartbeat of the released paths
+def test_release_semaphore_stops_heartbeat():
+    with patch('common.renew_lock_lease'):
+        thread = start_lock_heartbeat(103, "'/a'", lease_seconds=60)
+        with patch.dict(common.__dict__, {'_spark': MagicMock()}):
+            common.release_semaphore('cdl_tp_dev', 103, "'/a'")
+        thread.join(2)
+
+    assert not thread.is_alive()
+    assert common._lock_heartbeats == {}
+
+# Test the renewal statement for the postgres backend
+def test_renew_lock_lease_postgres():
+    conn = MagicMock()
+    conn.closed = 0
+    with patch.dict(common.__dict__, {
+        "postgres_schema": "mock_schema",
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }), patch("common.psycopg2.connect", return_value=conn):
+        common.renew_lock_lease(104, "'/a'", backend="postgres", lease_seconds=90)
+
+    query, params = conn.cursor.return_value.execute.call_args[0]
+    assert query.startswith("UPDATE mock_schema.tp_run_lock_plc SET lease_expiry = clock_timestamp() + make_interval(secs => %s)")
+    assert params == (90, 104)
+    conn.commit.assert_called_once()
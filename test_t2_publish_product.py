@@ -4,24 +4,24 @@ from common import t2_publish_product
 
 @pytest.fixture
 def mock_spark():
-    with patch("common.spark") as mock_spark:
+    with patch("common._spark") as mock_spark:
         yield mock_spark
 
 def test_publish_product_sql_execution(mock_spark):
     df_mock = MagicMock()
     df_empty_mock = MagicMock()
 
-    # Mock SQL return for limit 0
+    # Mock SQL return for the MERGE
     mock_spark.sql.return_value = df_empty_mock
-    df_mock.unionByName.return_value = df_mock
+    df_mock.dtypes = []
 
     t2_publish_product(df_mock, "test_catalog", "test_schema", "test_table")
 
-    # Check SQL query for limit 0
-    mock_spark.sql.assert_any_call("SELECT * FROM test_catalog.test_schema.test_table limit 0")
+    # Check the target schema is read from the table, not by a limit 0 query
+    mock_spark.table.assert_any_call("test_catalog.test_schema.test_table")
 
-    # Check unionByName called with allowMissingColumns=True
-    df_mock.unionByName.assert_called_once_with(df_empty_mock, allowMissingColumns=True)
+    # Check the DataFrame is aligned without a union
+    df_mock.unionByName.assert_not_called()
 
     # Check temp view creation
     df_mock.createOrReplaceTempView.assert_called_once_with("df_mm_prod_sdim_promo_vw")
@@ -38,6 +38,18 @@ def test_publish_product_sql_execution(mock_spark):
     """
     mock_spark.sql.assert_any_call(expected_merge_sql)
 
+def test_publish_product_invalidates_cached_schema(mock_spark):
+    df_mock = MagicMock()
+    df_mock.dtypes = []
+
+    calls = []
+    with patch("common.schema_registry") as mock_registry:
+        mock_registry.invalidate.side_effect = lambda table: calls.append(mock_spark.sql.call_args[0][0].strip())
+        t2_publish_product(df_mock, "test_catalog", "test_schema", "test_table")
+
+    mock_registry.invalidate.assert_called_once_with("test_catalog.test_schema.test_table")
+    assert calls[0].startswith("MERGE INTO test_catalog.test_schema.test_table")
+
 def test_publish_product_with_invalid_inputs(mock_spark):
     df_mock = MagicMock()
     mock_spark.sql.side_effect = Exception("Invalid SQL")
@@ -50,8 +62,8 @@ def test_publish_product_with_empty_df(mock_spark):
     df_empty_mock = MagicMock()
 
     mock_spark.sql.return_value = df_empty_mock
-    df_mock.unionByName.return_value = df_mock
+    df_mock.dtypes = []
 
     t2_publish_product(df_mock, "catalog", "schema", "table")
 
-    df_mock.unionByName.assert_called_once()
\ No newline at end of file
+    df_mock.createOrReplaceTempView.assert_called_once_with("df_mm_prod_sdim_promo_vw")
\ No newline at end of file
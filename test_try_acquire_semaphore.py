@@ -0,0 +1,89 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import common
+from common import try_acquire_semaphore
+
+# Helper to build a spark mock whose MERGE reports the given affected row count
+def _spark_mock(affected, blockers=()):
+    mock_spark = MagicMock()
+
+    def sql(query):
+        df = MagicMock()
+        if query.strip().startswith("MERGE INTO"):
+            df.first.return_value = {"num_affected_rows": affected}
+        else:
+            df.collect.return_value = [{"run_id": run_id} for run_id in blockers]
+        return df
+
+    mock_spark.sql.side_effect = sql
+    return mock_spark
+
+# Test an uncontended lock is granted by a single MERGE
+def test_try_acquire_semaphore_granted():
+    mock_spark = _spark_mock(affected=2)
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        result = try_acquire_semaphore(201, ["gold_tp/tp_prod_dim", ("gold_tp/tp_mkt_dim", "shared")])
+
+    assert result == {'granted': True, 'blocking_run_ids': [], 'check_path': "'gold_tp/tp_prod_dim', 'gold_tp/tp_mkt_dim'"}
+    mock_spark.sql.assert_called_once()
+    query = mock_spark.sql.call_args[0][0]
+    assert "MERGE INTO cdl_tp_dev.internal_tp.tp_run_lock_plc t" in query
+    assert "VALUES ('gold_tp/tp_prod_dim', 'exclusive'), ('gold_tp/tp_mkt_dim', 'shared')" in query
+    assert "WHERE NOT EXISTS" in query
+
+# Test a blocked lock is not granted and the blocking runs are reported
+def test_try_acquire_semaphore_blocked():
+    mock_spark = _spark_mock(affected=0, blockers=[7, 9])
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        result = try_acquire_semaphore(202, ["gold_tp/tp_prod_dim"])
+
+    assert result['granted'] is False
+    assert result['blocking_run_ids'] == [7, 9]
+    assert mock_spark.sql.call_count == 2
+
+# Test a MERGE that loses a write conflict is retried
+def test_try_acquire_semaphore_retries_write_conflict():
+    mock_spark = MagicMock()
+    granted = MagicMock()
+    granted.first.return_value = {"num_affected_rows": 1}
+    mock_spark.sql.side_effect = [Exception("ConcurrentAppendException: Files were added"), granted]
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}), \
+         patch('common.time.sleep') as mock_sleep:
+        result = try_acquire_semaphore(203, ["gold_tp/tp_prod_dim"])
+
+    assert result['granted'] is True
+    mock_sleep.assert_called_once()
+
+# Test other errors are raised
+def test_try_acquire_semaphore_error():
+    mock_spark = MagicMock()
+    mock_spark.sql.side_effect = Exception("Spark failure")
+
+    with patch.dict(common.__dict__, {'_spark': mock_spark, 'catalog_name': 'cdl_tp_dev'}):
+        with pytest.raises(Exception, match="Spark failure"):
+            try_acquire_semaphore(204, ["gold_tp/tp_prod_dim"])
+
+# Test the postgres backend checks and inserts in one transaction under the advisory lock
+def test_try_acquire_semaphore_postgres():
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = []
+    with patch.dict(common.__dict__, {
+        "postgres_schema": "mock_schema",
+        "refDBname": "testdb",
+        "refDBuser": "testuser",
+        "refDBpwd": "testpwd"
+    }), patch("common.psycopg2.connect", return_value=conn):
+        result = try_acquire_semaphore(205, ["gold_tp/tp_prod_dim"], backend="postgres")
+
+    assert result['granted'] is True
+    statements = [c[0][0].strip() for c in cursor.execute.call_args_list]
+    assert statements[0] == "SELECT pg_advisory_xact_lock(%s)"
+    assert statements[1].startswith("SELECT DISTINCT tbl.run_id")
+    assert statements[2].startswith("UPDATE mock_schema.tp_run_lock_plc SET lock_sttus = true")
+    assert statements[3].startswith("INSERT INTO mock_schema.tp_run_lock_plc")
+    conn.commit.assert_called_once()
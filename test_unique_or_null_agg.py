@@ -0,0 +1,47 @@
+import pytest
+from pyspark.sql import SparkSession
+from common import unique_or_null_agg, rollup_cols_for
+
+@pytest.fixture
+def spark():
+    return SparkSession.builder.getOrCreate()
+
+@pytest.fixture
+def df(spark):
+    return spark.createDataFrame([
+        ("C1", "S1", "BRAND A", "MFGR X"),
+        ("C1", "S1", "BRAND A", "MFGR Y"),
+        ("C1", "S1", None, "MFGR X"),
+        ("C2", "S1", None, None),
+    ], "pg_categ_txt string, pg_super_categ_txt string, pg_brand_txt string, pg_mfgr_txt string")
+
+# Test a single value is kept and several values give NULL, ignoring NULLs
+def test_unique_or_null_agg(df):
+    result = unique_or_null_agg(df, ["pg_categ_txt", "pg_super_categ_txt"], ["pg_brand_txt", "pg_mfgr_txt"])
+
+    rows = {r["pg_categ_txt"]: r.asDict() for r in result.collect()}
+    assert result.columns == ["pg_categ_txt", "pg_super_categ_txt", "pg_brand_txt", "pg_mfgr_txt"]
+    assert rows["C1"]["pg_brand_txt"] == "BRAND A"
+    assert rows["C1"]["pg_mfgr_txt"] is None
+    assert rows["C2"]["pg_brand_txt"] is None
+
+# Test strict mode treats a value mixed with NULLs as a conflict
+def test_unique_or_null_agg_strict(df):
+    result = unique_or_null_agg(df, ["pg_categ_txt", "pg_super_categ_txt"], ["pg_brand_txt"], strict=True)
+
+    rows = {r["pg_categ_txt"]: r["pg_brand_txt"] for r in result.collect()}
+    assert rows == {"C1": None, "C2": None}
+
+# Test no value columns returns the distinct groups
+def test_unique_or_null_agg_no_columns(df):
+    result = unique_or_null_agg(df, ["pg_categ_txt"], [])
+
+    assert sorted(r["pg_categ_txt"] for r in result.collect()) == ["C1", "C2"]
+
+# Test the rolled up columns are configurable per source system
+def test_rollup_cols_for():
+    config = {'default': ['pg_brand_txt'], 5: ['pg_brand_txt', 'pg_gbu_txt']}
+
+    assert rollup_cols_for(5, config) == ['pg_brand_txt', 'pg_gbu_txt']
+    assert rollup_cols_for("5", {'default': [], '5': ['pg_gbu_txt']}) == ['pg_gbu_txt']
+    assert rollup_cols_for(7, config) == ['pg_brand_txt']
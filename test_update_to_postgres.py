@@ -16,6 +16,7 @@ def mock_globals():
 # Test: Successful query execution
 def test_update_to_postgres_success(mock_globals):
     mock_conn = MagicMock()
+    mock_conn.closed = 0
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
 
@@ -32,7 +33,48 @@ def test_update_to_postgres_success(mock_globals):
         mock_cursor.execute.assert_called_once_with("UPDATE users SET active = true")
         mock_conn.commit.assert_called_once()
         mock_cursor.close.assert_called_once()
-        mock_conn.close.assert_called_once()
+        # The connection goes back to the pool instead of being closed
+        mock_conn.close.assert_not_called()
+
+# Test: Consecutive calls reuse the pooled connection
+def test_update_to_postgres_reuses_connection(mock_globals):
+    mock_conn = MagicMock()
+    mock_conn.closed = 0
+
+    with patch("common.psycopg2.connect", return_value=mock_conn) as mock_connect:
+        update_to_postgres("UPDATE users SET active = true")
+        update_to_postgres("UPDATE users SET active = false")
+
+        mock_connect.assert_called_once()
+        assert mock_conn.commit.call_count == 2
+
+# Test: A closed pooled connection is replaced on checkout
+def test_update_to_postgres_reconnects_closed_connection(mock_globals):
+    dead_conn = MagicMock()
+    dead_conn.closed = 0
+    fresh_conn = MagicMock()
+    fresh_conn.closed = 0
+
+    with patch("common.psycopg2.connect", side_effect=[dead_conn, fresh_conn]) as mock_connect:
+        update_to_postgres("UPDATE users SET active = true")
+        dead_conn.closed = 1
+        update_to_postgres("UPDATE users SET active = false")
+
+        assert mock_connect.call_count == 2
+        fresh_conn.cursor.return_value.execute.assert_called_once_with("UPDATE users SET active = false")
+
+# Test: Failed statement is rolled back and not committed
+def test_update_to_postgres_rollback_on_error(mock_globals):
+    mock_conn = MagicMock()
+    mock_conn.closed = 0
+    mock_conn.cursor.return_value.execute.side_effect = Exception("Syntax error")
+
+    with patch("common.psycopg2.connect", return_value=mock_conn):
+        with pytest.raises(Exception, match="Syntax error"):
+            update_to_postgres("UPDATE users SET")
+
+    mock_conn.commit.assert_not_called()
+    mock_conn.rollback.assert_called()
 
 # Test: Exception during query execution
 def test_update_to_postgres_exception(mock_globals):
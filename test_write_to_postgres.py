@@ -40,4 +40,96 @@ def test_write_to_postgres_exception(mock_df, mock_globals):
     mock_df.write.format.return_value = mock_writer
 
     with pytest.raises(Exception, match="Write failed"):
-        write_to_postgres(mock_df, "users")
\ No newline at end of file
+        write_to_postgres(mock_df, "users")
+
+# Fixture to run the COPY partition writer in-process with a mocked connection
+@pytest.fixture
+def copy_df():
+    df = MagicMock()
+    df.columns = ["id", "name"]
+    partitions = [[(1, "a"), (2, "b"), (3, None)], []]
+
+    def map_partitions(func):
+        result = MagicMock()
+        result.collect.side_effect = lambda: [r for i, rows in enumerate(partitions) for r in func(i, iter(rows))]
+        return result
+
+    df.rdd.mapPartitionsWithIndex.side_effect = map_partitions
+    return df
+
+# Fixture to mock psycopg2 connections and capture each COPY payload
+@pytest.fixture
+def copy_conn():
+    conn = MagicMock()
+    conn.closed = 0
+    payloads = []
+    conn.cursor.return_value.copy_expert.side_effect = lambda sql, stream: payloads.append((sql, stream.read()))
+    with patch("common.psycopg2.connect", return_value=conn):
+        yield conn, payloads
+
+# Test: COPY mode reports rows and bytes per partition
+def test_write_to_postgres_copy(copy_df, copy_conn, mock_globals):
+    conn, payloads = copy_conn
+
+    report = write_to_postgres(copy_df, "tp.results", method="copy")
+
+    assert [r["rows"] for r in report] == [3, 0]
+    assert report[0]["bytes"] == len("1,a\n2,b\n3,\\N\n")
+    assert payloads[0] == ("COPY tp.results (id, name) FROM STDIN WITH (FORMAT csv, NULL '\\N')", "1,a\n2,b\n3,\\N\n")
+    assert conn.commit.call_count == 2
+    copy_df.write.format.assert_not_called()
+
+# Test: COPY mode sends batch_size rows per COPY statement
+def test_write_to_postgres_copy_batches(copy_df, copy_conn, mock_globals):
+    conn, payloads = copy_conn
+
+    report = write_to_postgres(copy_df, "tp.results", method="copy", batch_size=2)
+
+    assert [data for _, data in payloads] == ["1,a\n2,b\n", "3,\\N\n"]
+    assert report[0]["rows"] == 3
+
+# Test: Staged COPY is published into the target in one transaction
+def test_write_to_postgres_copy_staging(copy_df, copy_conn, mock_globals):
+    conn, payloads = copy_conn
+
+    write_to_postgres(copy_df, "tp.results", method="copy", staging=True)
+
+    statements = [c[0][0] for c in conn.cursor.return_value.execute.call_args_list]
+    staging_table = statements[0].split()[2]
+    assert statements[0] == f"CREATE TABLE {staging_table} (LIKE tp.results INCLUDING ALL)"
+    assert payloads[0][0].startswith(f"COPY {staging_table} ")
+    assert statements[1:] == [f"INSERT INTO tp.results SELECT * FROM {staging_table}", f"DROP TABLE {staging_table}"]
+
+# Test: Overwrite swaps the staging table in and keeps the old table's sequences
+def test_write_to_postgres_copy_overwrite(copy_df, copy_conn, mock_globals):
+    conn, payloads = copy_conn
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [("tp.results_id_seq", "id", "a"), ("tp.results_run_seq", "run_id", "i")]
+    cursor.fetchone.return_value = (42, True)
+
+    write_to_postgres(copy_df, "tp.results", method="copy", staging=True, overwrite=True)
+
+    statements = [c[0][0] for c in cursor.execute.call_args_list]
+    staging_table = statements[0].split()[2]
+    old_table = statements[1].split()[-1]
+    assert statements[1] == f"ALTER TABLE tp.results RENAME TO {old_table}"
+    assert statements[2] == f"ALTER TABLE {staging_table} RENAME TO {staging_table.split('.')[1].rsplit('_stg_', 1)[0]}"
+    assert cursor.execute.call_args_list[3][0][1] == (f"tp.{old_table}",)
+    assert statements[4] == "ALTER SEQUENCE tp.results_id_seq OWNED BY tp.results.id"
+    assert statements[5] == "SELECT last_value, is_called FROM tp.results_run_seq"
+    assert cursor.execute.call_args_list[6][0][1] == ("tp.results", "run_id", 42, True)
+    assert statements[7] == f"DROP TABLE tp.{old_table}"
+
+# Test: JDBC batch options are only set when requested
+def test_write_to_postgres_jdbc_batch_options(mock_df, mock_globals):
+    mock_writer = MagicMock()
+    mock_writer.option.return_value = mock_writer
+    mock_writer.mode.return_value = mock_writer
+    mock_df.write.format.return_value = mock_writer
+
+    write_to_postgres(mock_df, "users", batch_size=5000, num_partitions=8)
+
+    mock_writer.option.assert_any_call("batchsize", 5000)
+    mock_writer.option.assert_any_call("reWriteBatchedInserts", "true")
+    mock_writer.option.assert_any_call("numPartitions", 8)
+    mock_writer.save.assert_called_once()